@@ -0,0 +1,83 @@
+"""
+Shared helpers of the benchmark scripts. They run against the database configured for the API (see config.ini) on
+behalf of the user given by the FL_BENCH_USER_ID environment variable. Use a copy of production data.
+"""
+import os
+import sys
+from contextlib import contextmanager
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Iterator, List, Tuple
+
+# run as plain scripts, i.e. the repository root has to be importable
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+# path needs to be fixed pylint: disable=wrong-import-position
+from flask_jwt_simple import create_jwt, jwt_required
+from sqlalchemy import event
+
+from web.api import app as _connexion_app
+from web.flask_modules.database import db
+
+app = _connexion_app.app
+
+
+def bench_user_id() -> int:
+    """:return: the user to run the benchmark for"""
+    try:
+        return int(os.environ['FL_BENCH_USER_ID'])
+    except (KeyError, ValueError):
+        sys.exit('set FL_BENCH_USER_ID to the id of a user with realistic amounts of data')
+
+
+@contextmanager
+def user_request(user_id: int, **kwargs: Any) -> Iterator[None]:
+    """
+    A request context authenticated as the user, i.e. controllers and `current_user_dao` can be used directly.
+    Use a new one per measured call, the ownership snapshot is memoized per request.
+    :param user_id: the user
+    :param kwargs: additional arguments for `Flask.test_request_context`
+    """
+    with app.app_context():
+        token = create_jwt(identity=dict(id=user_id, roles=['admin', 'tagger']))
+    with app.test_request_context(headers=dict(Authorization='Bearer ' + token), **kwargs):
+        jwt_required(lambda: None)()
+        yield
+        db.session.remove()
+
+
+class StatementCounter(object):
+    """Counts the SQL statements sent to the database while active"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def _count(self, *_args: Any) -> None:
+        self.count += 1
+
+    def __enter__(self) -> 'StatementCounter':
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+
+def measure(user_id: int, fun: Callable[[], Any], repeat: int = 5) -> Tuple[float, int]:
+    """
+    :param user_id: the user to run `fun` for
+    :param fun: the call to measure, executed in a fresh request context each time
+    :param repeat: number of measured runs, after one warm up run
+    :return: median milliseconds and statements of a run
+    """
+    timings: List[float] = []
+    statements = 0
+    for run in range(repeat + 1):
+        with user_request(user_id), StatementCounter() as counter:
+            start = perf_counter()
+            fun()
+            elapsed = perf_counter() - start
+        if run:
+            timings.append(elapsed * 1000)
+            statements = counter.count
+    return median(timings), statements
@@ -0,0 +1,23 @@
+"""
+Statements and latency of `GET /` (root_get) depending on `count`. With the batched parsing the number of statements
+has to stay constant, only the latency may grow with the page size.
+    FL_BENCH_USER_ID=1 python benchmarks/activity_listing.py
+"""
+from _support import bench_user_id, measure
+
+from web.api.controller.activity import root_get
+
+_COUNTS = (10, 50, 100, 250, 500, 1000)
+
+
+def main() -> None:
+    """print a row per page size"""
+    user_id = bench_user_id()
+    print('%8s %12s %12s' % ('count', 'statements', 'ms'))
+    for count in _COUNTS:
+        millis, statements = measure(user_id, lambda: root_get(count=count))
+        print('%8d %12d %12.1f' % (count, statements, millis))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Page 1 against page 1000 of the keyset paginated `GET /` (root_get). Deep pages have to cost about the same as the
+first one: similar latency and similar number of buffers touched by the plan.
+    FL_BENCH_USER_ID=1 python benchmarks/activity_paging.py
+Apply the migrations (`python -m web.api.migrate`) first, the range scan needs the (time, data_id) index.
+"""
+from typing import Optional
+
+from _support import bench_user_id, measure, user_request
+from sqlalchemy.dialects import postgresql
+
+from web.api.controller.activity import _activity_query_builder, _page, root_get
+from web.api.model.activities import encode_cursor
+from web.flask_modules.database import db
+
+_COUNT = 50
+_DEEP_PAGE = 1000
+
+
+def _deep_cursor() -> Optional[str]:
+    """:return: the cursor pointing to the start of the deep page, or None if there are not enough activities"""
+    builder = _activity_query_builder(None, None, None, None, None, None, None, None)
+    row = _page(builder, None).offset((_DEEP_PAGE - 1) * _COUNT - 1).limit(1).first()
+    return encode_cursor(*row[1:]) if row else None
+
+
+def _buffers(cursor: Optional[str]) -> int:
+    """:return: shared buffers hit or read by the plan of the page query"""
+    builder = _activity_query_builder(None, None, None, None, None, None, None, None)
+    statement = _page(builder, cursor).limit(_COUNT).statement.compile(dialect=postgresql.dialect(),
+                                                                        compile_kwargs=dict(literal_binds=True))
+    plan, = db.session.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) %s' % statement).scalar()
+    return plan['Plan']['Shared Hit Blocks'] + plan['Plan']['Shared Read Blocks']
+
+
+def main() -> None:
+    """print a row for the first and the deep page"""
+    user_id = bench_user_id()
+    with user_request(user_id):
+        cursor = _deep_cursor()
+    if cursor is None:
+        raise SystemExit('the user needs at least %d activities' % (_DEEP_PAGE * _COUNT))
+
+    print('%8s %12s %12s %12s' % ('page', 'statements', 'ms', 'buffers'))
+    for page, page_cursor in ((1, None), (_DEEP_PAGE, cursor)):
+        millis, statements = measure(user_id, lambda: root_get(count=_COUNT, cursor=page_cursor))
+        with user_request(user_id):
+            buffers = _buffers(page_cursor)
+        print('%8d %12d %12.1f %12d' % (page, statements, millis, buffers))
+
+
+if __name__ == '__main__':
+    main()
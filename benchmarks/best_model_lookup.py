@@ -0,0 +1,56 @@
+"""
+Best model of a query (`POST /model`, `fast`): the previous query ranking all models of the user with a correlated
+EXISTS over their sources, against the cached best models index, warm and right after its invalidation.
+    FL_BENCH_USER_ID=1 python benchmarks/best_model_lookup.py
+"""
+from typing import Optional, Tuple
+
+from _support import bench_user_id, measure, user_request
+
+from common.db.models.activities import Source
+from common.db.models.brain import Model
+from web.api.model.best_models import best_model_for_query, best_models_for_user, invalidate_best_models
+from web.api.model.user import current_user_dao
+from web.flask_modules.database import db
+
+
+def _exists_lookup(tagset_id: int, source_ids: Tuple[int, ...]) -> Optional[str]:
+    """:return: the id of the best model as resolved before the best models index"""
+    model = (current_user_dao.models
+             .filter(Model.tagset_id == tagset_id)
+             .filter(Model.sources.any(Source.id.in_(source_ids)))
+             .order_by(Model.score.desc(), Model.trained_ts.desc())
+             .limit(1)
+             .first())
+    return str(model.id) if model else None
+
+
+def _index_lookup(user_id: int, tagset_id: int, source_ids: Tuple[int, ...]) -> Optional[str]:
+    """:return: the id of the best model as resolved by `_best_model_query_by_dto`"""
+    best_model = best_model_for_query(user_id, tagset_id, source_ids)
+    model = db.session.query(Model).get(best_model.model_id) if best_model else None
+    return str(model.id) if model else None
+
+
+def main() -> None:
+    """print a row per lookup variant"""
+    user_id = bench_user_id()
+    with user_request(user_id):
+        best_models = best_models_for_user(user_id)
+        if not best_models:
+            raise SystemExit('the user needs a trained model')
+        tagset_id, source_ids = best_models[0].tagset_id, best_models[0].source_ids
+        if _exists_lookup(tagset_id, source_ids) != _index_lookup(user_id, tagset_id, source_ids):
+            print('warning: the lookups disagree, e.g. models with equal score and trained_ts')
+
+    print('%8s %12s %12s' % ('lookup', 'statements', 'ms'))
+    for name, lookup in (('exists', lambda: _exists_lookup(tagset_id, source_ids)),
+                         ('index', lambda: _index_lookup(user_id, tagset_id, source_ids)),
+                         ('cold', lambda: (invalidate_best_models(user_id),
+                                           _index_lookup(user_id, tagset_id, source_ids)))):
+        millis, statements = measure(user_id, lookup)
+        print('%8s %12d %12.1f' % (name, statements, millis))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Throughput of the bulk import (`insert_activities`, used by `POST /import` and the import task) for 100k activities,
+once as new activities and once more as duplicates, per chunk size. Everything is rolled back afterwards, only the
+random object ids stay in the bloom filter of the activity deduplication.
+    FL_BENCH_USER_ID=1 python benchmarks/import_throughput.py
+"""
+from time import perf_counter
+from typing import List
+from uuid import uuid4
+
+from _support import bench_user_id, user_request
+
+from web.api.model.activities import ImportDto, insert_activities
+from web.api.model.user import current_user_dao
+from web.flask_modules.database import db
+
+_ACTIVITIES = 100000
+_CHUNK_SIZES = (100, 1000, 5000)
+
+
+def _activities(source_id: int) -> List[ImportDto]:
+    """:return: synthetic activities with unique object ids, shaped like a facebook comment"""
+    prefix = 'bench-' + uuid4().hex
+    return [ImportDto(source_id=source_id,
+                      object_id='%s-%d' % (prefix, number),
+                      data={'message': 'benchmark activity number %d' % number,
+                            'created_time': '2017-01-01T00:00:00+0000',
+                            'from': {'id': str(number % 1000), 'name': 'user %d' % (number % 1000)}})
+            for number in range(_ACTIVITIES)]
+
+
+def _rows_per_second(activities: List[ImportDto], chunk_size: int) -> float:
+    start = perf_counter()
+    insert_activities(activities, chunk_size)
+    db.session.flush()
+    return len(activities) / (perf_counter() - start)
+
+
+def main() -> None:
+    """print a row per chunk size"""
+    print('%8s %14s %14s' % ('chunk', 'new rows/s', 'dup rows/s'))
+    for chunk_size in _CHUNK_SIZES:
+        with user_request(bench_user_id()):
+            if not current_user_dao.ownership.source_ids:
+                raise SystemExit('the user needs a source')
+            activities = _activities(min(current_user_dao.ownership.source_ids))
+            try:
+                new_rate = _rows_per_second(activities, chunk_size)
+                duplicate_rate = _rows_per_second(activities, chunk_size)
+            finally:
+                db.session.rollback()
+        print('%8d %14.0f %14.0f' % (chunk_size, new_rate, duplicate_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+The tests run against the database configured for the API (see config.ini) on behalf of the user given by the
+FL_TEST_USER_ID environment variable, they are skipped if it is not set. Use a copy of production data.
+Test modules skip themselves if the shared fanlens package is not installed, i.e. the API can not be imported.
+"""
+import os
+import sys
+from typing import Any, Iterator, List, Tuple
+
+import pytest
+
+# the repository root has to be importable without installing the package
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+
+@pytest.fixture
+def user_id() -> int:
+    """:return: the user to run the tests for"""
+    try:
+        return int(os.environ['FL_TEST_USER_ID'])
+    except (KeyError, ValueError):
+        pytest.skip('set FL_TEST_USER_ID to the id of a user with realistic amounts of data')
+
+
+@pytest.fixture
+def user_request(user_id: int) -> Iterator[int]:
+    """
+    A request context authenticated as the user, i.e. controllers and `current_user_dao` can be used directly.
+    :return: the user id
+    """
+    # pylint: disable=redefined-outer-name
+    from flask_jwt_simple import create_jwt, jwt_required
+    from web.api import app as _connexion_app
+    from web.flask_modules.database import db
+
+    app = _connexion_app.app
+    with app.app_context():
+        token = create_jwt(identity=dict(id=user_id, roles=['admin', 'tagger']))
+    with app.test_request_context(headers=dict(Authorization='Bearer ' + token)):
+        jwt_required(lambda: None)()
+        yield user_id
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def client(user_id: int) -> Iterator[Tuple[Any, str]]:
+    """:return: a test client of the API sending the JWT of the user, and the base path of the API"""
+    # pylint: disable=redefined-outer-name
+    from flask_jwt_simple import create_jwt
+    from common.config import get_config
+    from web.api import app as _connexion_app
+
+    app = _connexion_app.app
+    with app.app_context():
+        token = create_jwt(identity=dict(id=user_id, roles=['admin', 'tagger']))
+    test_client = app.test_client()
+    test_client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+    yield test_client, '/' + get_config().get('DEFAULT', 'version')
+
+
+@pytest.fixture
+def statements(user_request: int) -> Iterator[List[str]]:
+    """:return: the SQL statements sent to the database while the test runs, filled in as they are executed"""
+    # pylint: disable=unused-argument,redefined-outer-name
+    from sqlalchemy import event
+    from web.flask_modules.database import db
+
+    executed: List[str] = []
+
+    def _collect(_connection: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _collect)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', _collect)
@@ -0,0 +1,69 @@
+"""Plans of the composed activity listing queries"""
+from typing import Any, Dict, Iterator
+
+import pytest
+
+pytest.importorskip('common')  # the shared fanlens package
+
+# pylint: disable=wrong-import-position
+from sqlalchemy.orm import Query
+
+from common.db.models.activities import Language, Tag, Tagging
+from web.api.model.activities import ActivityQueryBuilder
+from web.api.model.user import current_user_dao
+from web.flask_modules.database import db
+
+_INDEX_SCANS = frozenset(('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'))
+
+
+def _explain(query: Query) -> Dict[str, Any]:
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    plan, = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return plan['Plan']
+
+
+def _nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from _nodes(child)
+
+
+def _combined_query(user_id: int) -> Query:
+    tagset_ids = sorted(current_user_dao.ownership.tagset_ids)[:2]
+    tags = [tag for tag, in db.session.query(Tag.tag).filter(Tag.id.in_(current_user_dao.ownership.tag_ids)).limit(2)]
+    assert tagset_ids and tags, 'the test user needs tags and tagsets'
+    return (ActivityQueryBuilder(user_id)
+            .tagsets(tagset_ids)
+            .tags(tags)
+            .languages(['en', 'de'])
+            .query())
+
+
+def test_filters_are_semi_joins(user_request: int) -> None:
+    """tags, tagsets and languages combined are EXISTS semi joins, i.e. they do not duplicate rows"""
+    query = _combined_query(user_request)
+    sql = str(query.statement.compile(dialect=db.engine.dialect))
+    assert sql.count('EXISTS') == 3
+    # the relations are only referenced inside the EXISTS clauses, i.e. they can not duplicate rows
+    outer_from = sql.split('WHERE', 1)[0]
+    assert Tagging.__table__.fullname not in outer_from
+    assert Language.__table__.fullname not in outer_from
+
+    nodes = list(_nodes(_explain(query)))
+    assert any(node.get('Join Type') == 'Semi' or node.get('Parent Relationship') == 'SubPlan' for node in nodes)
+
+    data_ids = [data.id for data in query.limit(1000)]
+    assert len(data_ids) == len(set(data_ids))
+
+
+def test_filter_indices_exist(user_request: int) -> None:
+    """every filter relation can be read via an index, whether the planner picks it depends on the table sizes"""
+    query = _combined_query(user_request)
+    db.session.execute('SET LOCAL enable_seqscan = off')
+    scans = [(node['Relation Name'], node['Node Type'])
+             for node in _nodes(_explain(query)) if 'Relation Name' in node]
+    tagging_scans = [node_type for relation, node_type in scans if relation == Tagging.__tablename__]
+    language_scans = [node_type for relation, node_type in scans if relation == Language.__tablename__]
+    assert len(tagging_scans) == 2  # tagsets and tags
+    assert len(language_scans) == 1
+    assert all(node_type in _INDEX_SCANS for node_type in tagging_scans + language_scans), scans
@@ -0,0 +1,39 @@
+"""Decoding of the opaque listing cursors"""
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('common')  # the shared fanlens package
+
+# pylint: disable=wrong-import-position
+from web.api.model.activities import cursor_float, cursor_int, cursor_time, decode_cursor, encode_cursor
+
+_TIME_KEY = (cursor_time, cursor_int)
+_RANK_KEY = (cursor_float, cursor_int)
+
+
+def test_round_trip() -> None:
+    """values are decoded into the types of the sort key"""
+    time = datetime(2017, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(time, 42), _TIME_KEY) == [time, 42]
+    assert decode_cursor(encode_cursor(0.1, 42), _RANK_KEY) == [0.1, 42]
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    encode_cursor('x', 1),
+    encode_cursor('2017-01-01T00:00:00', '1'),
+    encode_cursor('2017-01-01T00:00:00', True),
+    encode_cursor('2017-01-01T00:00:00'),
+    encode_cursor(0.5, 1),  # rank cursor of a search
+])
+def test_malformed_time_cursor(cursor: str) -> None:
+    """anything but a (time, id) cursor is rejected before it reaches the database"""
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, _TIME_KEY)
+
+
+def test_time_cursor_with_search() -> None:
+    """a time cursor reused for a search is rejected"""
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(datetime(2017, 1, 1), 1), _RANK_KEY)
@@ -0,0 +1,39 @@
+"""Streaming import, the body is read while importing"""
+import json
+from typing import Any, Tuple
+from uuid import uuid4
+
+import pytest
+
+pytest.importorskip('common')  # the shared fanlens package
+
+# pylint: disable=wrong-import-position
+from common.db.models.activities import Data
+from web.api.model.user import current_user_dao
+from web.flask_modules.database import db
+
+
+def test_import_stream_inserts(user_request: int, client: Tuple[Any, str]) -> None:
+    """every posted line is imported, progress is reported per chunk"""
+    # pylint: disable=unused-argument
+    if not current_user_dao.ownership.source_ids:
+        pytest.skip('the test user needs a source')
+    source_id = min(current_user_dao.ownership.source_ids)
+    object_ids = ['test-%s-%d' % (uuid4().hex, number) for number in range(3)]
+    body = ''.join(json.dumps(dict(id=object_id, source_id=source_id, data=dict(message='test %s' % object_id))) + '\n'
+                   for object_id in object_ids)
+
+    test_client, base = client
+    response = test_client.post(base + '/import/stream?chunk_size=2', data=body,
+                                content_type='application/x-ndjson')
+    assert response.status_code == 200
+    progress = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    try:
+        assert [chunk['accepted'] for chunk in progress] == [2, 1]
+        inserted = (db.session.query(Data.object_id)
+                    .filter(Data.source_id == source_id, Data.object_id.in_(object_ids)).all())
+        assert sorted(object_id for object_id, in inserted) == sorted(object_ids)
+    finally:
+        db.session.query(Data).filter(Data.source_id == source_id, Data.object_id.in_(object_ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,31 @@
+"""Number of statements of the listing endpoints, it must not grow with the number of listed entities"""
+from typing import List
+
+import pytest
+
+pytest.importorskip('common')  # the shared fanlens package
+
+# pylint: disable=wrong-import-position
+from web.api.controller.model import model_get
+from web.api.controller.tagsets import tagsets_get
+from web.api.model.user import current_user_dao
+
+
+def test_tagsets_get_statements(statements: List[str]) -> None:
+    """all tagsets are listed with a single statement"""
+    if len(current_user_dao.ownership.tagset_ids) < 2:
+        pytest.skip('the test user needs several tagsets')
+    statements.clear()  # loading the ownership snapshot is not part of the listing
+    tagsets = tagsets_get()['tagSets']
+    assert len(tagsets) == len(current_user_dao.ownership.tagset_ids)
+    assert len(statements) == 1, statements
+
+
+def test_model_get_statements(statements: List[str]) -> None:
+    """all models are listed with a single statement"""
+    if len(current_user_dao.ownership.model_ids) < 2:
+        pytest.skip('the test user needs several models')
+    statements.clear()
+    models = model_get()['models']
+    assert len(models) == len(current_user_dao.ownership.model_ids)
+    assert len(statements) == 1, statements
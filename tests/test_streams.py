@@ -0,0 +1,36 @@
+"""Streaming endpoints, their bodies must not be buffered"""
+import json
+from typing import Any, Tuple
+
+import pytest
+
+pytest.importorskip('common')  # the shared fanlens package
+
+
+def test_stream_is_lazy(client: Tuple[Any, str]) -> None:
+    """the body is still a pending generator when the response leaves the app"""
+    test_client, base = client
+    response = test_client.get(base + '/stream?count=3&languages=en,de', buffered=False)
+    assert response.status_code == 200
+    assert response.is_streamed
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    response.close()
+    if len(lines) < 4:
+        pytest.skip('the test user needs more activities')
+    activities, trailer = lines[:-1], lines[-1]
+    assert len(activities) == 3
+    assert set(trailer) == {'cursor'}
+
+    resumed = test_client.get(base + '/stream?count=3&languages=en,de&cursor=' + trailer['cursor'])
+    resumed_lines = [json.loads(line) for line in resumed.get_data(as_text=True).splitlines()]
+    assert resumed_lines
+    seen = set(json.dumps(activity, sort_keys=True) for activity in activities)
+    assert not seen.intersection(json.dumps(line, sort_keys=True) for line in resumed_lines)
+
+
+def test_stream_rejects_bad_args(client: Tuple[Any, str]) -> None:
+    """the parameters are checked like the ones of the Swagger definition"""
+    test_client, base = client
+    assert test_client.get(base + '/stream?count=1000001').status_code == 400
+    assert test_client.get(base + '/stream?random=true&count=501').status_code == 400
+    assert test_client.get(base + '/stream?cursor=invalid').status_code == 400
@@ -9,15 +9,19 @@ def setup_app(flask_app: Flask) -> None:
     Setup the flask modules used in the app
     :param flask_app: the app
     """
+    from ..flask_modules.cache import setup_cache
     from ..flask_modules.celery import setup_celery
     from ..flask_modules.database import setup_db
     from ..flask_modules.mail import setup_mail
     from ..flask_modules.jwt import setup_jwt
     from ..flask_modules.cors import setup_cors
     from ..flask_modules.logging import setup_logging
+    from ..flask_modules.redis import setup_redis
 
     setup_logging(flask_app)
     setup_db(flask_app)
+    setup_cache(flask_app)
+    setup_redis(flask_app)
     setup_mail(flask_app)
     setup_jwt(flask_app)
     setup_cors(flask_app)
@@ -32,10 +36,12 @@ def create_app() -> App:
 
     from ..flask_modules.connexion import TaggedSimpleResolver
     from . import controller
+    from .controller.streams import STREAMS_BP
     new_app.add_api('api.yaml',
                     validate_responses=True,
                     resolver=TaggedSimpleResolver(controller),
                     swagger_url='/api')
+    new_app.app.register_blueprint(STREAMS_BP)  # not part of api.yaml, connexion would buffer the bodies
     new_app.add_url_rule('/', 'health', lambda: 'ok')
 
     return new_app
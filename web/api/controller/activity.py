@@ -1,19 +1,20 @@
 """Implementations for the activities.yaml Swagger definition. See yaml / Swagger UI for documentation."""
-from operator import itemgetter
+from itertools import islice
 # see swagger pylint: disable=missing-docstring,too-many-arguments
-from typing import Optional, Tuple, Union, cast
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union, cast
 
-from sqlalchemy import text
+from flask import Response, json, stream_with_context
+from sqlalchemy import tablesample, text, tuple_
 from sqlalchemy.orm import Query
 
 from common.db import insert_or_ignore
-from common.db.models.activities import Data, Language, Source, SourceUser, Tag, TagSetUser, TagTagSet, TagUser, \
-    Tagging, Time
+from common.db.models.activities import Data, Source, SourceUser, Tag, TagUser, Tagging
 from . import defaults
 from ..model import table_names
-from ..model.activities import parse
+from ..model.activities import ActivityParser, ActivityQueryBuilder, decode_cursor, encode_cursor, parse, parse_all
+from ..model.tags import TagCount
 from ..model.user import current_user_dao
-from ...flask_modules import TJson, TJsonResponse, deleted_response, updated_response
+from ...flask_modules import TJson, TJsonResponse, bad_arg, deleted_response, updated_response
 from ...flask_modules.database import db
 
 
@@ -25,65 +26,161 @@ def _activity_query(source_id: int, activity_id: str) -> Query:
     return current_user_dao.data.filter((Source.id == source_id) & (Data.object_id == activity_id))
 
 
+_SAMPLE_OVERSAMPLING = 10
+_SAMPLE_GROWTH = 10
+# beyond this sample rate sampling does not pay off, i.e. there are few matching rows which can be shuffled directly
+_MAX_SAMPLE_PERCENT = 10.0
+
+
+def _estimated_rows(data_query: Query) -> float:
+    """:return: the planner's estimate of the number of rows matching the query, without executing it"""
+    compiled = data_query.statement.compile(dialect=db.engine.dialect)
+    plan, = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return max(plan['Plan']['Plan Rows'], 1.0)
+
+
+def _random_sample(data_query: Query, count: int) -> List[Data]:
+    """
+    Draw a random sample using TABLESAMPLE SYSTEM, i.e. the cost depends on the number of sampled pages instead of
+    the table size. The sample rate is sized by the estimated number of rows matching the filters of `data_query`
+    and grows once if the sample was too small. Selective filters (high sample rates) shuffle the matching rows
+    directly instead, which is cheap exactly because there are few of them.
+    :param data_query: the filtered `Data` query to sample from
+    :param count: the number of rows to draw
+    :return: up to `count` random rows
+    """
+    percent = 100.0 * count * _SAMPLE_OVERSAMPLING / _estimated_rows(data_query)
+    for _ in range(2):
+        if percent > _MAX_SAMPLE_PERCENT:
+            break
+        sample = tablesample(Data.__table__, percent, name='data_sample')
+        data: List[Data] = ActivityParser.eager(
+            data_query
+            .filter(Data.id.in_(db.session.query(sample.c.id)))
+            .order_by(db.func.random())
+            .limit(count)).all()
+        if len(data) >= count:
+            return data
+        percent *= _SAMPLE_GROWTH
+    return ActivityParser.eager(data_query.order_by(db.func.random()).limit(count)).all()
+
+
+def _activity_query_builder(max_id: Optional[str],
+                             since: Optional[str],
+                             until: Optional[str],
+                             source_ids: Optional[list],
+                             tagset_ids: Optional[list],
+                             tags: Optional[list],
+                             languages: Optional[list],
+                             q: Optional[str]) -> ActivityQueryBuilder:
+    return (ActivityQueryBuilder(current_user_dao.user_id)
+            .sources(source_ids)
+            .max_object_id(max_id)
+            .time_range(since, until)
+            .tagsets(tagset_ids)
+            .tags(tags)
+            .languages(languages)
+            .search(q))
+
+
+def _page(builder: ActivityQueryBuilder, cursor: Optional[str]) -> Query:
+    """
+    :return: query yielding rows of the form (data, *sort_key), sorted descending by the sort key
+    :raise ValueError: if the cursor is malformed
+    """
+    sort_key = builder.sort_key
+    data_query = builder.query().add_columns(*sort_key)
+    if cursor:
+        # row comparison matches the sort order, i.e. allows an index range scan on e.g. (time, data_id)
+        data_query = data_query.filter(tuple_(*sort_key) < tuple_(*decode_cursor(cursor, builder.sort_key_types)))
+    return data_query.order_by(*(column.desc() for column in sort_key))
+
+
 @defaults
 def root_get(count: int,
              max_id: Optional[str] = None,
+             cursor: Optional[str] = None,
              since: Optional[str] = None,
              until: Optional[str] = None,
              source_ids: Optional[list] = None,
              tagset_ids: Optional[list] = None,
              tags: Optional[list] = None,
              languages: Optional[list] = None,
+             q: Optional[str] = None,
              random: Optional[bool] = False) -> TJsonResponse:
-    data_query = (db.session.query(Data)
-                  .filter(Data.source_id.in_(current_user_dao.source_ids)))
-
-    if since or until or not random:
-        data_query = data_query.join(Time, Time.data_id == Data.id)
-
-    if source_ids:
-        data_query = data_query.filter(Data.source_id.in_(source_ids))
-
-    if max_id:
-        data_query = data_query.filter(Data.object_id < max_id)
-
-    if since:
-        data_query = data_query.filter(Time.time >= since)
-    if until:
-        data_query = data_query.filter(Time.time <= until)
-
-    if tagset_ids:
-        data_query = (data_query
-                      .join(Tagging, Tagging.data_id == Data.id)
-                      .join(TagTagSet, TagTagSet.tag_id == Tagging.tag_id)
-                      .join(TagSetUser,
-                            (TagSetUser.tagset_id == TagTagSet.tagset_id) &
-                            (TagSetUser.user_id == current_user_dao.user_id))
-                      .filter(TagTagSet.tagset_id.in_(tuple(tagset_ids))))
-    if tags:
-        data_query = (data_query
-                      .join(Tagging, Tagging.data_id == Data.id)
-                      .join(Tag, Tag.id == Tagging.tag_id)
-                      .join(TagUser,
-                            (TagUser.tag_id == Tag.id) &
-                            (TagUser.user_id == current_user_dao.user_id))
-                      .filter(Tag.tag.in_(tags)))
+    builder = _activity_query_builder(max_id, since, until, source_ids, tagset_ids, tags, languages, q)
 
     if random:
-        data_query = data_query.order_by(
-            db.func.random())  # inefficient but ok for now, see also random_rows stored procedure
-    else:
-        data_query = data_query.order_by(Time.time.desc())
+        data = _random_sample(builder.query(ordered=False), count)
+        return dict(activities=parse_all(data))
+
+    try:
+        page_query = _page(builder, cursor)
+    except ValueError as err:
+        return bad_arg(err)
+    rows = ActivityParser.eager(page_query.limit(count)).all()
+
+    result: Dict[str, Any] = dict(activities=parse_all(row[0] for row in rows))
+    if rows and len(rows) == count:
+        result['cursor'] = encode_cursor(*rows[-1][1:])
+    return result
+
+
+_STREAM_CHUNK_SIZE = 100
+# a random sample is drawn at once, i.e. held in memory, same limit as for GET /
+_MAX_RANDOM_STREAM_COUNT = 500
 
-    if languages:
-        data_query = (data_query
-                      .join(Language, Language.data_id == Data.id)
-                      .filter(Language.language.in_(languages)))
 
-    data_query = data_query.limit(count)
+def _ndjson(rows: Iterable[Sequence[Any]], count: int) -> Iterator[str]:
+    """
+    parse and serialize the activities chunk wise, i.e. only one chunk is held in memory at a time
+    :param rows: rows of the form (data, *sort_key), the sort key is missing for random samples
+    :param count: the requested number of activities, if it was reached a last line with the cursor to resume follows
+    """
+    rows_iter = iter(rows)
+    written = 0
+    last_row: Optional[Sequence[Any]] = None
+    while True:
+        chunk = list(islice(rows_iter, _STREAM_CHUNK_SIZE))
+        if not chunk:
+            break
+        for parsed in parse_all(row[0] for row in chunk):
+            yield json.dumps(parsed) + '\n'
+        written += len(chunk)
+        last_row = chunk[-1]
+    if last_row is not None and len(last_row) > 1 and written == count:
+        yield json.dumps(dict(cursor=encode_cursor(*last_row[1:]))) + '\n'
 
-    data = [parse(data) for data in data_query]
-    return dict(activities=list(data))
+
+@defaults
+def stream_get(count: int,
+               cursor: Optional[str] = None,
+               since: Optional[str] = None,
+               until: Optional[str] = None,
+               source_ids: Optional[list] = None,
+               tagset_ids: Optional[list] = None,
+               tags: Optional[list] = None,
+               languages: Optional[list] = None,
+               q: Optional[str] = None,
+               random: Optional[bool] = False) -> Union[TJsonResponse, Response]:
+    builder = _activity_query_builder(None, since, until, source_ids, tagset_ids, tags, languages, q)
+
+    rows: Iterable[Sequence[Any]]
+    if random:
+        if count > _MAX_RANDOM_STREAM_COUNT:
+            return bad_arg(ValueError('count must not exceed %d for random samples' % _MAX_RANDOM_STREAM_COUNT))
+        rows = [(data,) for data in _random_sample(builder.query(ordered=False), count)]
+    else:
+        try:
+            page_query = _page(builder, cursor)
+        except ValueError as err:
+            return bad_arg(err)
+        # server side cursor, rows are fetched from the db as they are written to the client
+        rows = (ActivityParser.eager(page_query.limit(count))
+                .execution_options(stream_results=True)
+                .yield_per(_STREAM_CHUNK_SIZE))
+
+    return Response(stream_with_context(_ndjson(rows, count)), mimetype='application/x-ndjson')
 
 
 @defaults
@@ -106,7 +203,7 @@ def source_id_activity_id_put(source_id: int,
         db.session.rollback()
         return dict(error="source_id does not match activity"), 400
 
-    if source_id not in map(itemgetter(0), current_user_dao.source_ids.all()):
+    if not current_user_dao.ownership.owns_source(source_id):
         db.session.rollback()
         return dict(error=f"user {current_user_dao.user_id} not associated to source {source_id}"), 403
 
@@ -146,6 +243,7 @@ def source_id_activity_id_tags_patch(source_id: int,  # pylint: disable=invalid-
             INNER JOIN %(source_user_table)s as source_user ON data.source_id = source_user.source_id AND source_user.user_id = :user_id  -- data belongs to user
             INNER JOIN %(tag_user_table)s as tag_user ON tag.id = tag_user.tag_id AND tag_user.user_id = :user_id  -- tag belongs to user
             WHERE tag.tag in :add
+            ORDER BY tag.id  -- the tag_count trigger locks rows in insertion order, see `activities_tags_patch`
             ON CONFLICT DO NOTHING;
             
             DELETE FROM %(tagging_table)s as tagging
@@ -176,3 +274,82 @@ def source_id_activity_id_tags_patch(source_id: int,  # pylint: disable=invalid-
     if isinstance(data, tuple):  # error
         return cast(Tuple[TJson, int], data)
     return {'id': activity_id, 'tags': [tag.tag for tag in data.tags]}
+
+
+@defaults
+def activities_tags_patch(body: dict) -> TJsonResponse:
+    remove = list(set(body.get('remove', [])))
+    add = list(set(body.get('add', [])).difference(remove))  # consistent with the single patch: remove wins
+    source_ids = [activity['source_id'] for activity in body['activities']]
+    object_ids = [activity['id'] for activity in body['activities']]
+    user_id = current_user_dao.user_id
+    names = table_names(tagging_table=Tagging,
+                        tag_table=Tag,
+                        tag_user_table=TagUser,
+                        tag_count_table=TagCount,
+                        data_table=Data,
+                        source_user_table=SourceUser)
+
+    target_sql = text("""
+    SELECT data.id
+    FROM unnest(CAST(:source_ids AS INTEGER[]), CAST(:object_ids AS TEXT[])) AS activity(source_id, object_id)
+    JOIN %(data_table)s as data ON data.source_id = activity.source_id AND data.object_id = activity.object_id
+    JOIN %(source_user_table)s as source_user ON data.source_id = source_user.source_id AND source_user.user_id = :user_id  -- data belongs to user
+    """ % names)
+    data_ids = [data_id for data_id, in db.session.execute(target_sql, dict(source_ids=source_ids,
+                                                                            object_ids=object_ids,
+                                                                            user_id=user_id))]
+    if not data_ids:
+        db.session.rollback()
+        return dict(error='No activities found for user'), 404
+
+    # the tag_count trigger updates one row per tag, concurrent patches sharing tags could deadlock if they locked the
+    # rows in different orders. Existing rows are locked upfront ordered by id, new ones are inserted in id order.
+    lock_sql = text("""
+    SELECT tag_count.tag_id
+    FROM %(tag_count_table)s as tag_count
+    JOIN %(tag_table)s as tag ON tag.id = tag_count.tag_id
+    JOIN %(tag_user_table)s as tag_user ON tag.id = tag_user.tag_id AND tag_user.user_id = :user_id  -- tag belongs to user
+    WHERE tag.tag = ANY (:tags)
+    ORDER BY tag_count.tag_id
+    FOR UPDATE OF tag_count
+    """ % names)
+    if add or remove:
+        db.session.execute(lock_sql, dict(user_id=user_id, tags=add + remove))
+
+    if add:
+        add_sql = text("""
+        INSERT INTO %(tagging_table)s (tag_id, data_id, tagging_ts)
+        SELECT tag.id as tag_id, data_id, now() as tagging_ts
+        FROM %(tag_table)s as tag
+        INNER JOIN %(tag_user_table)s as tag_user ON tag.id = tag_user.tag_id AND tag_user.user_id = :user_id  -- tag belongs to user
+        CROSS JOIN unnest(CAST(:data_ids AS BIGINT[])) AS data_id
+        WHERE tag.tag = ANY (:add)
+        ORDER BY tag.id, data_id
+        ON CONFLICT DO NOTHING
+        """ % names)
+        db.session.execute(add_sql, dict(data_ids=data_ids, user_id=user_id, add=add))
+    if remove:
+        remove_sql = text("""
+        DELETE FROM %(tagging_table)s as tagging
+        USING %(tag_user_table)s as tag_user,
+              %(tag_table)s as tag
+        WHERE tag.tag = ANY (:remove) AND
+              tag.id = tag_user.tag_id AND tag_user.user_id = :user_id AND  -- tag belongs to user
+              tagging.tag_id = tag.id AND
+              tagging.data_id = ANY (:data_ids)
+        """ % names)
+        db.session.execute(remove_sql, dict(data_ids=data_ids, user_id=user_id, remove=remove))
+
+    tags_sql = text("""
+    SELECT data.source_id, data.object_id, array_remove(array_agg(tag.tag), NULL)
+    FROM %(data_table)s as data
+    LEFT OUTER JOIN %(tagging_table)s as tagging ON tagging.data_id = data.id
+    LEFT OUTER JOIN %(tag_table)s as tag ON tag.id = tagging.tag_id
+    WHERE data.id = ANY (:data_ids)
+    GROUP BY data.id, data.source_id, data.object_id
+    """ % names)
+    activities = [dict(id=object_id, source=dict(id=source_id), tags=tags)
+                  for source_id, object_id, tags in db.session.execute(tags_sql, dict(data_ids=data_ids))]
+    db.session.commit()
+    return dict(activities=activities)
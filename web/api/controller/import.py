@@ -1,23 +1,122 @@
 """Implementations for the activities.yaml Swagger definition. See yaml / Swagger UI for documentation."""
 # see swagger pylint: disable=missing-docstring,too-many-arguments
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from celery.result import AsyncResult
+from flask import Response, json, request, stream_with_context
+
+from common.config import get_config
 from . import defaults
-from .activity import source_id_activity_id_put
-from ...flask_modules import TJsonResponse
+from .. import tasks
+from ..model.activities import ImportDto, insert_activities
+from ..model.dedup import content_id
+from ..model.user import current_user_dao
+from ...flask_modules import TJson, TJsonResponse
+from ...flask_modules.cache import cache
+from ...flask_modules.celery import celery
 from ...flask_modules.database import db
 
+_CONFIG = get_config()
+
+
+def _import_dto(activity: TJson) -> Union[ImportDto, Tuple[TJson, int]]:
+    if 'id' not in activity:
+        activity['id'] = content_id(activity['data'])
+    if 'source_id' not in activity:
+        return dict(error='no source_id found for ' + str(activity['id'])), 404
+    if not current_user_dao.ownership.owns_source(activity['source_id']):
+        return dict(error=f"user {current_user_dao.user_id} not associated to source {activity['source_id']}"), 403
+    return ImportDto(source_id=activity['source_id'],
+                     object_id=str(activity['id']),
+                     data=activity['data'])
+
+
+_IMPORT_JOB_TIMEOUT = 60 * 60 * 24
+
+
+def _import_job_key(job_id: str) -> str:
+    return 'import_job:%s' % job_id
+
 
 @defaults
-def root_post(import_activities: dict) -> TJsonResponse:
-    ids = set()
+def root_post(import_activities: dict, background: bool = False) -> TJsonResponse:
+    activities: List[ImportDto] = []
     for activity in import_activities['activities']:
-        if 'id' not in activity:
-            activity['id'] = hash(activity['data'])
-        if 'source_id' not in activity:
-            return dict(error='no source_id found for ' + activity['id']), 404
-        ids.add((activity['source_id'], activity['id']))
-        err: TJsonResponse = source_id_activity_id_put(activity['source_id'], activity['id'], activity, False)
-        if 'error' in err:
-            db.session.rollback()
-            return err
+        dto = _import_dto(activity)
+        if not isinstance(dto, ImportDto):
+            return dto
+        activities.append(dto)
+
+    if background:
+        job = tasks.import_activities.delay(tasks.stage_import(activities))
+        cache.set(_import_job_key(job.id), current_user_dao.user_id, timeout=_IMPORT_JOB_TIMEOUT)
+        return dict(job=job.id, url='/%s/import/jobs/%s' % (_CONFIG.get('DEFAULT', 'version'), job.id)), 202
+
+    insert_activities(activities)
     db.session.commit()
+    ids = set((activity.source_id, activity.object_id) for activity in activities)
     return dict(activities=[dict(id=activity_id, source=dict(id=source_id)) for source_id, activity_id in ids]), 201
+
+
+_MAX_REPORTED_ERRORS = 100
+
+
+def _import_chunks(lines: Iterable[bytes], chunk_size: int) -> Iterator[str]:
+    """import the activities chunk wise, committing and reporting the progress after every chunk"""
+    numbered_lines = enumerate(lines, start=1)
+    chunk_number = 0
+    while True:
+        chunk = list(islice(numbered_lines, chunk_size))
+        if not chunk:
+            return
+        chunk_number += 1
+
+        activities: List[ImportDto] = []
+        errors: List[TJson] = []
+        for line_number, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                activity = json.loads(line)
+                if not isinstance(activity, dict) or 'data' not in activity:
+                    raise ValueError('not an activity')
+            except ValueError as err:
+                errors.append(dict(line=line_number, error=str(err)))
+                continue
+            dto = _import_dto(activity)
+            if isinstance(dto, ImportDto):
+                activities.append(dto)
+            else:
+                error_json, _ = dto
+                errors.append(dict(line=line_number, error=error_json['error']))
+
+        inserted = insert_activities(activities)
+        db.session.commit()
+        yield json.dumps(dict(chunk=chunk_number,
+                              accepted=inserted,
+                              duplicates=len(activities) - inserted,
+                              errors=len(errors),
+                              error_details=errors[:_MAX_REPORTED_ERRORS])) + '\n'
+
+
+@defaults
+def import_stream_post(chunk_size: int = 1000) -> Response:
+    # the body is read line by line while the import progresses, i.e. it never has to fit into memory. Served by
+    # `streams`, connexion would have read the body already.
+    return Response(stream_with_context(_import_chunks(request.stream, chunk_size)),
+                    mimetype='application/x-ndjson')
+
+
+@defaults
+def import_jobs_job_id_get(job_id: str) -> TJsonResponse:
+    if cache.get(_import_job_key(job_id)) != current_user_dao.user_id:
+        return dict(error='Import job not found'), 404
+
+    result = AsyncResult(job_id, app=celery)
+    status = dict(job=job_id, state=result.state)
+    if result.failed():
+        status['error'] = str(result.info)
+    elif isinstance(result.info, dict):
+        status.update(result.info)
+    return status
@@ -2,35 +2,45 @@
 # see swagger pylint: disable=missing-docstring
 
 from contextlib import suppress
-from typing import Optional
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import text
+from celery.exceptions import TimeoutError as ResultTimeoutError
+from flask import json
+from sqlalchemy import false
 from sqlalchemy.orm import Query
 from sqlalchemy.orm.exc import NoResultFound
 
 from common.config import get_config
-from common.db.models.activities import Source, SourceUser, TagSetUser
 from common.db.models.brain import Model
 from . import defaults
-from ..model import table_names
-from ..model.model import ModelQueryDto, model_query_dto, model_to_json, prediction_query_dto
+from .. import tasks
+from ..model.best_models import best_model_for_query
+from ..model.model import ModelQueryDto, model_query_dto, model_to_json, models_for_user_json, prediction_query_dto
+from ..model.prediction import TPrediction, predict_texts, prediction_batcher, prediction_cache
+from ..model.tags import tag_dictionary
+from ..model.training import claim_training, release_training, training_key
 from ..model.user import current_user_dao
 from ...flask_modules import TJson, TJsonResponse, bad_arg
-from ...flask_modules.celery import brain
+from ...flask_modules.cache import cache
+from ...flask_modules.celery import TResult, brain, dispatch_metrics, task_result
 from ...flask_modules.database import db
-from ...flask_modules.jwt import current_user_id, roles_all
+from ...flask_modules.jwt import roles_all
 
 _CONFIG = get_config()
+# upper bound for waiting on a prediction, a backlog of the brain queue must not pin all web workers
+_PREDICTION_DEADLINE = _CONFIG.getfloat('CELERY', 'prediction_deadline', fallback=10.0)
+_PREDICTION_JOB_TIMEOUT = 60 * 60
 
 
 @defaults
 def model_get() -> TJsonResponse:
-    return dict(models=[model_to_json(model) for model in current_user_dao.models])
+    return dict(models=models_for_user_json(current_user_dao.user_id))
 
 
 @defaults
 def model_model_id_get(model_id: str) -> TJsonResponse:
-    model = current_user_dao.models.filter(Model.id == model_id).one_or_none()
+    model = db.session.query(Model).get(model_id) if current_user_dao.ownership.owns_model(model_id) else None
     if not model:
         return dict(error='Model not found'), 404
     return model_to_json(model)
@@ -44,18 +54,8 @@ def model_train_post(body: TJson, fast: bool = True) -> TJsonResponse:
     except ValueError as err:
         return bad_arg(err)
 
-    tagset_source_check_sql = text("""
-    SELECT count(*) = array_length(:source_ids, 1)	
-    FROM %(tagset_user_table)s as tagset_user
-    JOIN %(source_user_table)s as source_user ON source_user.user_id = tagset_user.user_id
-    WHERE tagset_user.user_id = :user_id AND
-          tagset_user.tagset_id = :tagset_id AND
-          source_user.source_id = ANY (:source_ids)
-    """ % table_names(tagset_user_table=TagSetUser, source_user_table=SourceUser))
-    valid = db.engine.execute(tagset_source_check_sql,
-                              tagset_id=dto.tagset_id,
-                              source_ids=dto.source_ids,
-                              user_id=current_user_id()).scalar()
+    valid = bool(dto.source_ids) and current_user_dao.ownership.owns_tagset(dto.tagset_id) and \
+        all(current_user_dao.ownership.owns_source(source_id) for source_id in dto.source_ids)
     if not valid:
         return dict(error="user does not have access to all specified ressources"), 403
 
@@ -70,30 +70,36 @@ def model_train_post(body: TJson, fast: bool = True) -> TJsonResponse:
             params = best_model.params
             score = best_model.score
 
-    job = brain.train_model(current_user_dao.user_id,
-                            dto.tagset_id,
-                            tuple(dto.source_ids or []),
-                            n_estimators=10,
-                            _params=params,
-                            _score=score)
+    # single-flight: identical trainings which are still queued or running are not started again
+    lease_key = training_key(current_user_dao.user_id, dto.tagset_id, dto.source_ids)
+    job_id, claimed = claim_training(lease_key)
+    if claimed:
+        release = tasks.release_training_lease.si(lease_key, job_id, current_user_dao.user_id).set(queue='web')
+        try:
+            brain.train_model.apply_async((current_user_dao.user_id, dto.tagset_id, tuple(dto.source_ids or [])),
+                                          dict(n_estimators=10, _params=params, _score=score),
+                                          task_id=job_id, link=release, link_error=release)
+        except Exception:
+            release_training(lease_key, job_id)
+            raise
     if fast and model_id is not None:
         redir_url = '/%s/model/%s' % (_CONFIG.get('DEFAULT', 'version'), str(model_id))
     else:
         redir_url = '/%s/search' % _CONFIG.get('DEFAULT', 'version')
-    return dict(job=job.id, url=redir_url), 202
+    return dict(job=job_id, url=redir_url), 202
 
 
 def _best_model_query_by_id(model_id: str) -> Query:
-    return current_user_dao.models.filter(Model.id == model_id).limit(1)
+    if not current_user_dao.ownership.owns_model(model_id):
+        return db.session.query(Model).filter(false())
+    return db.session.query(Model).filter(Model.id == model_id).limit(1)
 
 
 def _best_model_query_by_dto(query: ModelQueryDto) -> Query:
-    matching = current_user_dao.models
-    if query.tagset_id:
-        matching = matching.filter(Model.tagset_id == query.tagset_id)
-    if query.source_ids:
-        matching = matching.filter(Model.sources.any(Source.id.in_(query.source_ids)))
-    return matching.order_by(Model.score.desc(), Model.trained_ts.desc()).limit(1)
+    best_model = best_model_for_query(current_user_dao.user_id, query.tagset_id, query.source_ids)
+    if best_model is None:
+        return db.session.query(Model).filter(false())
+    return db.session.query(Model).filter(Model.id == best_model.model_id)
 
 
 @defaults
@@ -112,8 +118,24 @@ def model_search_post(body: TJson) -> TJsonResponse:
         return dict(error='No model found for this query'), 404
 
 
+def _prediction_job_key(job_id: str) -> str:
+    # per user, identical predictions of several users can share one job
+    return 'prediction_job:%s:%d' % (job_id, current_user_dao.user_id)
+
+
+def _prediction_job(job: TResult, model: Model, text: str) -> TJson:
+    """remember the job for the polling endpoint"""
+    cache.set(_prediction_job_key(job.id), (str(model.id), model.tagset_id, text), timeout=_PREDICTION_JOB_TIMEOUT)
+    return dict(job=job.id, url='/%s/model/prediction/%s' % (_CONFIG.get('DEFAULT', 'version'), job.id))
+
+
+def _prediction_json(tagset_id: int, text: str, prediction: TPrediction) -> TJson:
+    tag_names = tag_dictionary.names(tagset_id, (tag_id for tag_id, _ in prediction))
+    return dict(text=text, prediction=dict((tag_names[tag_id], score) for tag_id, score in prediction))
+
+
 @defaults
-def model_prediction_post(body: TJson, model_id: Optional[str] = None) -> TJsonResponse:
+def model_prediction_post(body: TJson, model_id: Optional[str] = None, background: bool = False) -> TJsonResponse:
     dto = prediction_query_dto(body)
 
     try:
@@ -123,10 +145,97 @@ def model_prediction_post(body: TJson, model_id: Optional[str] = None) -> TJsonR
             query_dto = model_query_dto(body.get('model_query', dict()))
             model_query = _best_model_query_by_dto(query_dto)
         model: Model = model_query.one()
-        prediction = brain.predict_text(str(model.id), dto.text).get()
-        prediction = dict((model.tags.filter_by(id=k).one().tag, v) for k, v in prediction)
-        return dict(text=dto.text, prediction=prediction)
     except NoResultFound:
         return dict(error='No model found for this query'), 404
     except ValueError as err:
         return bad_arg(err)
+
+    key = (str(model.id), dto.text)
+    prediction, = prediction_cache.get_many([key])
+    if prediction is not None:
+        return _prediction_json(model.tagset_id, dto.text, prediction)
+
+    job = prediction_batcher.predict(*key)
+    if background:
+        return _prediction_job(job, model, dto.text), 202
+    try:
+        # waits on the result backend's notification, not by polling
+        prediction = job.get(timeout=_PREDICTION_DEADLINE)
+    except ResultTimeoutError:
+        return dict(error='prediction did not finish within %gs' % _PREDICTION_DEADLINE,
+                    **_prediction_job(job, model, dto.text)), 504
+    prediction_cache.set_many([key], [prediction])
+    return _prediction_json(model.tagset_id, dto.text, prediction)
+
+
+@defaults
+def model_prediction_job_id_get(job_id: str, wait: float = 0.0) -> TJsonResponse:
+    prediction_job = cache.get(_prediction_job_key(job_id))
+    if prediction_job is None:
+        return dict(error='Prediction job not found'), 404
+    model_id, tagset_id, text = prediction_job
+
+    result = task_result(job_id)
+    wait = min(wait, _PREDICTION_DEADLINE)
+    if not result.ready():
+        if wait <= 0:  # a zero timeout would block indefinitely
+            return dict(job=job_id, state=result.state), 202
+        try:
+            result.get(timeout=wait, propagate=False)
+        except ResultTimeoutError:
+            return dict(job=job_id, state=result.state), 202
+    if result.failed():
+        return dict(error=str(result.result)), 500
+    prediction_cache.set_many([(model_id, text)], [result.result])
+    return _prediction_json(tagset_id, text, result.result)
+
+
+@defaults
+def model_prediction_batch_post(body: TJson, model_id: Optional[str] = None) -> TJsonResponse:
+    queries = [dict(text=text) for text in body.get('texts', [])] + list(body.get('queries', []))
+    default_model_query = body.get('model_query', dict())
+
+    models: Dict[str, Model] = dict()  # the texts of a batch usually share very few models
+    predictions: List[Tuple[Model, str]] = []
+    try:
+        if not queries:
+            raise ValueError('No text provided')
+        for query in queries:
+            dto = prediction_query_dto(query)
+            model_query = query.get('model_query', default_model_query)
+            key = model_id or json.dumps(model_query, sort_keys=True)
+            if key not in models:
+                models[key] = (_best_model_query_by_id(model_id) if model_id
+                               else _best_model_query_by_dto(model_query_dto(model_query))).one()
+            predictions.append((models[key], dto.text))
+    except NoResultFound:
+        return dict(error='No model found for this query'), 404
+    except ValueError as err:
+        return bad_arg(err)
+
+    keys = [(str(model.id), text) for model, text in predictions]
+    cached = prediction_cache.get_many(keys)
+    missing = [key for key, prediction in zip(keys, cached) if prediction is None]
+    results = dict(zip(missing, predict_texts(missing)))
+    deadline = monotonic() + _PREDICTION_DEADLINE
+    try:
+        predicted = dict((key, result.get(timeout=max(deadline - monotonic(), 0.001)))
+                         for key, result in results.items())
+    except ResultTimeoutError:
+        return dict(error='predictions did not finish within %gs' % _PREDICTION_DEADLINE), 504
+    prediction_cache.set_many(list(predicted.keys()), list(predicted.values()))
+    return dict(predictions=[
+        _prediction_json(model.tagset_id, text, predicted[key] if prediction is None else prediction)
+        for (model, text), key, prediction in zip(predictions, keys, cached)])
+
+
+@defaults
+@roles_all('admin')
+def model_prediction_cache_get() -> TJsonResponse:
+    return prediction_cache.stats()
+
+
+@defaults
+@roles_all('admin')
+def model_dispatch_get() -> TJsonResponse:
+    return dict(tasks=dispatch_metrics.snapshot())
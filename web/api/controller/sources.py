@@ -43,12 +43,13 @@ def sources_post(source: dict) -> Union[TJsonResponse, Response]:
                                    uri=source['type'],
                                    slug=source['slug'],
                                    user_id=current_user_dao.user_id).first()
+    current_user_dao.ownership.invalidate()
     return redirect('/sources/%d' % source_id, code=201)
 
 
 @defaults
 def sources_source_id_get(source_id: int) -> TJsonResponse:
-    source = current_user_dao.sources.filter_by(id=source_id).one_or_none()
+    source = db.session.query(Source).get(source_id) if current_user_dao.ownership.owns_source(source_id) else None
     if source:
         return dict(id=source.id,
                     type=source.type,
@@ -59,7 +60,7 @@ def sources_source_id_get(source_id: int) -> TJsonResponse:
 
 @defaults
 def sources_source_id_patch(source_id: int, source: dict) -> TJsonResponse:
-    user_source = current_user_dao.sources.filter_by(id=source_id).one_or_none()
+    user_source = db.session.query(Source).get(source_id) if current_user_dao.ownership.owns_source(source_id) else None
     if user_source is None:
         return dict(error="source does not exist"), 404
     if 'id' in source:
@@ -76,7 +77,8 @@ def sources_source_id_patch(source_id: int, source: dict) -> TJsonResponse:
 
 @defaults
 def sources_source_id_delete(source_id: int) -> TJsonResponse:
-    db.session.query(Source).filter((Source.id == source_id) & Source.id.in_(current_user_dao.source_ids)).delete(
-        synchronize_session=False)
+    owned_source = (Source.id == source_id) & Source.id.in_(current_user_dao.ownership.source_ids)
+    db.session.query(Source).filter(owned_source).delete(synchronize_session=False)
     db.session.commit()
+    current_user_dao.ownership.invalidate()
     return deleted_response()
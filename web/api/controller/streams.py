@@ -0,0 +1,125 @@
+"""
+Streaming endpoints, served as plain Flask routes next to the Swagger definition: connexion reads the whole request
+body before calling a handler and the whole response body to validate it, i.e. nothing would be streamed. The
+parameters are parsed here with the same limits the Swagger definition would enforce.
+"""
+from datetime import datetime
+from importlib import import_module
+from typing import Any, Callable, List, Optional, TypeVar, Union
+
+from flask import Blueprint, Response, jsonify, request
+
+from common.config import get_config
+from .activity import stream_get
+from ...flask_modules import TJsonResponse, bad_arg
+
+_CONFIG = get_config()
+_IMPORT_CONTROLLER = import_module('.import', __package__)  # a keyword, i.e. can not be imported directly
+
+TItem = TypeVar('TItem')
+
+STREAMS_BP = Blueprint('streams', __name__, url_prefix='/%s' % _CONFIG.get('DEFAULT', 'version'))
+
+
+def _int_arg(name: str, default: int, minimum: int, maximum: int) -> int:
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError('%s must be an integer' % name)
+    if not minimum <= number <= maximum:
+        raise ValueError('%s must be between %d and %d' % (name, minimum, maximum))
+    return number
+
+
+def _list_arg(name: str, item_type: Callable[[str], TItem], max_items: int) -> Optional[List[TItem]]:
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        items = [item_type(item) for item in value.split(',')]
+    except ValueError:
+        raise ValueError('%s contains an invalid item' % name)
+    if len(items) > max_items or len(set(items)) != len(items):
+        raise ValueError('%s must be at most %d unique items' % (name, max_items))
+    return items
+
+
+def _str_arg(name: str, max_length: int) -> Optional[str]:
+    value = request.args.get(name)
+    if value is not None and not 1 <= len(value) <= max_length:
+        raise ValueError('%s must be 1 to %d characters long' % (name, max_length))
+    return value
+
+
+def _time_arg(name: str) -> Optional[str]:
+    value = request.args.get(name)
+    if value is not None:
+        try:
+            datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('%s must be a date-time' % name)
+    return value
+
+
+def _bool_arg(name: str) -> bool:
+    value = request.args.get(name, 'false').lower()
+    if value not in ('true', 'false'):
+        raise ValueError('%s must be true or false' % name)
+    return value == 'true'
+
+
+def _sized(min_length: int, max_length: int) -> Callable[[str], str]:
+    def _check(value: str) -> str:
+        if not min_length <= len(value) <= max_length:
+            raise ValueError('wrong length')
+        return value
+    return _check
+
+
+def _response(result: Union[TJsonResponse, Response]) -> Any:
+    if isinstance(result, Response):
+        return result
+    if isinstance(result, tuple):
+        body, status = result
+        return body if isinstance(body, Response) else jsonify(body), status
+    return jsonify(result)
+
+
+@STREAMS_BP.route('/stream', methods=['GET'])
+def stream() -> Any:
+    """
+    GET /stream: same filters as GET /, but every activity is written as a single JSON line as soon as it is loaded.
+    If `count` activities were written, a last line {"cursor": ...} follows to resume the stream with. Random samples
+    are limited to 500 activities and can not be resumed.
+    """
+    try:
+        kwargs = dict(count=_int_arg('count', 1000, 0, 1000000),
+                      cursor=_str_arg('cursor', 256),
+                      since=_time_arg('since'),
+                      until=_time_arg('until'),
+                      source_ids=_list_arg('source_ids', int, 10),
+                      tagset_ids=_list_arg('tagset_ids', int, 10),
+                      tags=_list_arg('tags', _sized(1, 32), 30),
+                      languages=_list_arg('languages', _sized(2, 12), 30) or ['en'],
+                      q=_str_arg('q', 256),
+                      random=_bool_arg('random'))
+    except ValueError as err:
+        return _response(bad_arg(err))
+    return _response(stream_get(**kwargs))
+
+
+@STREAMS_BP.route('/import/stream', methods=['POST'])
+def import_stream() -> Any:
+    """
+    POST /import/stream: the body is newline delimited JSON, one Import (including source_id) per line. The activities
+    are imported and committed in chunks of `chunk_size` lines, the progress of each chunk is reported as an
+    ImportProgress line of the response.
+    """
+    try:
+        chunk_size = _int_arg('chunk_size', 1000, 1, 10000)
+    except ValueError as err:
+        return _response(bad_arg(err))
+    return _response(_IMPORT_CONTROLLER.import_stream_post(chunk_size=chunk_size))
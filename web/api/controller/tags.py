@@ -5,9 +5,10 @@ from contextlib import suppress
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 
-from common.db.models.activities import Data, Tag, TagUser, Tagging
+from common.db.models.activities import Tag, TagUser
 from . import defaults
 from ..model import table_names
+from ..model.tags import TagCount, tag_dictionary
 from ..model.user import current_user_dao
 from ...flask_modules import TJson, TJsonResponse, deleted_response
 from ...flask_modules.database import db
@@ -19,13 +20,11 @@ def tags_get(with_count: bool = False) -> TJsonResponse:
     if with_count:
         tags: TJson = dict()
         with_count_sql = text("""
-        SELECT tag.tag, count(*)
+        SELECT tag.tag, coalesce(tag_count.count, 0)
         FROM %(tag_table)s as tag
         JOIN %(tag_user_table)s as tag_user ON tag_user.tag_id = tag.id AND tag_user.user_id = :user_id
-        LEFT OUTER JOIN %(tagging_table)s as tagging ON tagging.tag_id = tag.id
-        GROUP BY tag.tag  -- tag is unique per user
-        """ % table_names(data_table=Data,
-                          tagging_table=Tagging,
+        LEFT OUTER JOIN %(tag_count_table)s as tag_count ON tag_count.tag_id = tag.id
+        """ % table_names(tag_count_table=TagCount,
                           tag_table=Tag,
                           tag_user_table=TagUser))
         tags['count'] = dict((tag, tag_count)
@@ -45,7 +44,7 @@ def tags_tag_get(tag: str, with_count: bool = False) -> TJsonResponse:
 
     result = dict(tag=the_tag.tag)
     if with_count:
-        result['count'] = the_tag.data.count()
+        result['count'] = db.session.query(TagCount.count).filter(TagCount.tag_id == the_tag.id).scalar() or 0
     return result
 
 
@@ -56,8 +55,10 @@ def tags_tag_put(tag: str, commit: bool = True) -> TJsonResponse:
         db.session.add(tag_obj)
         # todo: performance - one unnecessary roundtrip. ignore until relevant
         current_user_dao.self.one().tags.append(tag_obj)
-        if commit:
+        if commit:  # otherwise the caller has to invalidate after committing
             db.session.commit()
+            # not before, a concurrent request could cache the old ownership under the new version
+            current_user_dao.ownership.invalidate()
     return dict(tag=tag_obj.tag), 201
 
 
@@ -65,4 +66,6 @@ def tags_tag_put(tag: str, commit: bool = True) -> TJsonResponse:
 def tags_tag_delete(tag: str) -> TJsonResponse:
     current_user_dao.created_tags.filter(Tag.tag == tag).delete()
     db.session.commit()
+    tag_dictionary.invalidate()
+    current_user_dao.ownership.invalidate()
     return deleted_response()
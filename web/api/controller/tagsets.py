@@ -9,7 +9,8 @@ from common.db.models.activities import Tag, TagSet, TagSetUser, TagTagSet, TagU
 from . import defaults
 from .tags import tags_tag_put
 from ..model import table_names
-from ..model.activities import tagset_to_json
+from ..model.activities import tagsets_for_user_json
+from ..model.tags import tag_dictionary
 from ..model.user import current_user_dao
 from ...flask_modules import TJson, TJsonResponse, deleted_response, updated_response
 from ...flask_modules.database import db
@@ -17,8 +18,7 @@ from ...flask_modules.database import db
 
 @defaults
 def tagsets_get() -> TJsonResponse:
-    tagsets = [tagset_to_json(tagset) for tagset in current_user_dao.tagsets]
-    return dict(tagSets=tagsets)
+    return dict(tagSets=tagsets_for_user_json(current_user_dao.user_id))
 
 
 @defaults
@@ -54,6 +54,7 @@ def tagsets_post(tagset: TJson) -> Union[TJsonResponse, Response]:
                                     user_id=current_user_dao.user_id,
                                     tags=tagset['tags'],
                                     title=tagset['title']))
+    current_user_dao.ownership.invalidate()
     if not result:
         return dict(error='no tagset created'), 200
 
@@ -62,7 +63,7 @@ def tagsets_post(tagset: TJson) -> Union[TJsonResponse, Response]:
 
 @defaults
 def tagsets_tagset_id_get(tagset_id: int) -> TJsonResponse:
-    tagset = current_user_dao.tagsets.filter(TagSet.id == tagset_id).one_or_none()
+    tagset = db.session.query(TagSet).get(tagset_id) if current_user_dao.ownership.owns_tagset(tagset_id) else None
     if not tagset:
         return dict(error="tagset does not exist"), 404
     return dict(id=tagset.id,
@@ -70,9 +71,30 @@ def tagsets_tagset_id_get(tagset_id: int) -> TJsonResponse:
                 tags=[tag.tag for tag in tagset.tags])
 
 
+_SYNC_TAGSET_TAGS_SQL = text("""
+WITH desired_tag AS (
+    SELECT tag.id as tag_id
+    FROM %(tag_table)s as tag
+    JOIN %(tag_user_table)s as tag_user ON tag.id = tag_user.tag_id AND tag_user.user_id = :user_id
+    WHERE tag.tag = ANY (:tags)
+),
+removed_tag AS (
+    DELETE FROM %(tag_tagset_table)s as tag_tagset
+    WHERE :replace AND
+          tag_tagset.tagset_id = :tagset_id AND
+          tag_tagset.tag_id NOT IN (SELECT tag_id FROM desired_tag)
+    RETURNING tag_tagset.tag_id
+)
+INSERT INTO %(tag_tagset_table)s (tag_id, tagset_id)
+SELECT tag_id, :tagset_id as tagset_id
+FROM desired_tag
+ON CONFLICT DO NOTHING;
+""" % table_names(tag_tagset_table=TagTagSet, tag_table=Tag, tag_user_table=TagUser))
+
+
 @defaults
-def tagsets_tagset_id_patch(tagset_id: int, tagset: dict) -> TJsonResponse:
-    user_tagset = current_user_dao.tagsets.filter_by(id=tagset_id).one_or_none()
+def tagsets_tagset_id_patch(tagset_id: int, tagset: dict, replace_tags: bool = False) -> TJsonResponse:
+    user_tagset = db.session.query(TagSet).get(tagset_id) if current_user_dao.ownership.owns_tagset(tagset_id) else None
     if user_tagset is None:
         return dict(error="tagset does not exist"), 404
     if 'id' in tagset:
@@ -80,10 +102,13 @@ def tagsets_tagset_id_patch(tagset_id: int, tagset: dict) -> TJsonResponse:
     if 'title' in tagset:
         user_tagset.title = tagset['title']
     if 'tags' in tagset:
-        tags = set(tagset['tags'])
-        for tag in tags:
-            tagsets_tagset_id_tag_put(user_tagset.id, tag)
+        # single statement in the same transaction as the title change
+        db.session.execute(_SYNC_TAGSET_TAGS_SQL, dict(user_id=current_user_dao.user_id,
+                                                       tagset_id=user_tagset.id,
+                                                       tags=list(set(tagset['tags'])),
+                                                       replace=replace_tags))
     db.session.commit()
+    tag_dictionary.invalidate()
 
     return tagsets_tagset_id_get(user_tagset.id)
 
@@ -92,6 +117,8 @@ def tagsets_tagset_id_patch(tagset_id: int, tagset: dict) -> TJsonResponse:
 def tagsets_tagset_id_delete(tagset_id: int) -> TJsonResponse:
     current_user_dao.tagsets.filter(TagSet.id == tagset_id).delete(synchronize_session=False)
     db.session.commit()
+    tag_dictionary.invalidate()
+    current_user_dao.ownership.invalidate()
     return deleted_response()
 
 
@@ -112,14 +139,16 @@ def tagsets_tagset_id_tag_put(tagset_id: int, tag: str) -> TJsonResponse:
                                     tag=tag))
     if len(result) != 1:
         return dict(error="could not add tag to tagset"), 400
+    tag_dictionary.invalidate()
     return updated_response()
 
 
 @defaults
 def tagsets_tagset_id_tag_delete(tagset_id: int, tag: str) -> TJsonResponse:
     db.session.query(TagTagSet).filter(
-        TagTagSet.tagset_id.in_(current_user_dao.tagset_ids) &
+        TagTagSet.tagset_id.in_(current_user_dao.ownership.tagset_ids) &
         (TagTagSet.tagset_id == tagset_id) &
         (TagTagSet.tag.has(tag=tag))).delete(synchronize_session=False)
     db.session.commit()
+    tag_dictionary.invalidate()
     return deleted_response()
@@ -0,0 +1,81 @@
+"""
+Database objects the API layer relies on in addition to the common schema, e.g. indices and trigger maintained tables.
+Apply them after deploying via `python -m web.api.migrate`. Applied migrations are recorded and skipped later on,
+i.e. every migration runs once per database. They are idempotent nevertheless, e.g. to survive an interrupted run.
+"""
+from typing import List, NamedTuple
+
+from sqlalchemy import text
+
+from common.db.models.activities import Text, Time
+from .model import table_names
+from .model.tags import TAG_COUNT_TABLE_SQL, TAG_COUNT_TRIGGER_SQL
+from ..flask_modules.database import db
+
+
+class Migration(NamedTuple):
+    """A named, idempotent schema change"""
+    name: str
+    description: str
+    sql: str
+    # False e.g. for CREATE INDEX CONCURRENTLY, which is not allowed inside a transaction block
+    transactional: bool = True
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(name='ix_time_time_data_id',
+              description='keyset pagination of activity listings',
+              sql="""
+              CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_time_time_data_id ON %(time_table)s (time, data_id)
+              """ % table_names(time_table=Time),
+              transactional=False),
+    Migration(name='ix_text_tsvector',
+              description='full text search of activities',
+              sql="""
+              CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_text_tsvector ON %(text_table)s
+              USING gin (to_tsvector('english'::regconfig, text))
+              """ % table_names(text_table=Text),
+              transactional=False),
+    # creating the trigger locks the tagging table until the commit, i.e. the backfill misses no concurrent tagging
+    Migration(name='tag_count',
+              description='trigger maintained number of taggings per tag',
+              sql=TAG_COUNT_TABLE_SQL + TAG_COUNT_TRIGGER_SQL),
+]
+
+
+_APPLIED_TABLE = (Time.__table__.schema + '.' if Time.__table__.schema else '') + 'api_migration'
+_CREATE_APPLIED_SQL = text("""
+CREATE TABLE IF NOT EXISTS %s (
+    name TEXT PRIMARY KEY,
+    applied_ts TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)""" % _APPLIED_TABLE)
+_APPLIED_SQL = text('SELECT name FROM %s' % _APPLIED_TABLE)
+_RECORD_SQL = text('INSERT INTO %s (name) VALUES (:name) ON CONFLICT (name) DO NOTHING' % _APPLIED_TABLE)
+
+
+def migrate() -> None:
+    """Apply the migrations not applied yet in order, needs an app context"""
+    with db.engine.begin() as connection:
+        connection.execute(_CREATE_APPLIED_SQL)
+        applied = frozenset(name for name, in connection.execute(_APPLIED_SQL))
+
+    for migration in MIGRATIONS:
+        if migration.name in applied:
+            continue
+        print('applying %s: %s' % (migration.name, migration.description))
+        if migration.transactional:
+            with db.engine.begin() as connection:
+                connection.execute(text(migration.sql))
+                connection.execute(_RECORD_SQL, name=migration.name)
+        else:
+            with db.engine.connect() as connection:
+                autocommit = connection.execution_options(isolation_level='AUTOCOMMIT')
+                autocommit.execute(text(migration.sql))
+                autocommit.execute(_RECORD_SQL, name=migration.name)
+
+
+if __name__ == '__main__':
+    from . import app
+
+    with app.app.app_context():
+        migrate()
@@ -1,12 +1,28 @@
 """ Models and helpers for activities api """
 
-from typing import Any, Callable, Dict, Union, List
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import defaultdict
+from itertools import islice
+from datetime import datetime
+from typing import Any, Callable, DefaultDict, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import text
+from sqlalchemy import Float, Index, and_, cast, exists, func, literal_column, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Query, joinedload
+from sqlalchemy.sql import ClauseElement, ColumnElement
 
-from common.db.models.activities import Data, Lang, Source, TagSet, Type
+from common.db.models.activities import Data, Lang, Language, Source, Tag, TagSet, TagSetUser, TagTagSet, TagUser, \
+    Tagging, Text, Time, Type
 from common.db.models.brain import Prediction
+from . import table_names
+from .best_models import best_models_for_user
+from .dedup import activity_bloom_filter
+from .tags import tag_dictionary
 from .user import current_user_dao
+from ...flask_modules import TJson
+from ...flask_modules.database import db
 
 
 def source_to_json(source: Source) -> Dict[str, Union[int, str]]:
@@ -32,37 +48,248 @@ def tagset_to_json(tagset: TagSet) -> Dict[str, Union[int, str, List[str]]]:
         tags=[tag.tag for tag in tagset.tags])
 
 
+_TAGSETS_FOR_USER_SQL = text("""
+SELECT tagset.id, tagset.title, array_remove(array_agg(tag.tag ORDER BY tag.tag), NULL) as tags
+FROM %(tagset_table)s as tagset
+JOIN %(tagset_user_table)s as tagset_user ON tagset_user.tagset_id = tagset.id AND tagset_user.user_id = :user_id
+LEFT OUTER JOIN %(tag_tagset_table)s as tag_tagset ON tag_tagset.tagset_id = tagset.id
+LEFT OUTER JOIN %(tag_table)s as tag ON tag.id = tag_tagset.tag_id
+GROUP BY tagset.id, tagset.title
+ORDER BY tagset.id
+""" % table_names(tagset_table=TagSet,
+                  tagset_user_table=TagSetUser,
+                  tag_tagset_table=TagTagSet,
+                  tag_table=Tag))
+
+
+def tagsets_for_user_json(user_id: int) -> List[Dict[str, Union[int, str, List[str]]]]:
+    """
+    :param user_id: the user to list the tagsets for
+    :return: all tagsets of the user like `tagset_to_json`, loaded including their tags with a single query
+    """
+    return [dict(id=tagset_id, title=title, tags=tags)
+            for tagset_id, title, tags in db.session.execute(_TAGSETS_FOR_USER_SQL, dict(user_id=user_id))]
+
+
+_TS_CONFIG = literal_column("'english'::regconfig")
+_TEXT_VECTOR = func.to_tsvector(_TS_CONFIG, Text.text)
+
+# full text search index, the search has to use the exact same expression to make use of it, see `migrate`
+Index('ix_text_tsvector', _TEXT_VECTOR, postgresql_using='gin')
+# keyset pagination by time, sort key and cursor comparison have to use exactly these columns, see `migrate`
+Index('ix_time_time_data_id', Time.time, Time.data_id)
+
+
+def encode_cursor(*sort_key: Any) -> str:
+    """
+    :param sort_key: the sort key values of the last row of a page, e.g. (time, id)
+    :return: an opaque cursor pointing behind this row
+    """
+    sort_key = tuple(value.isoformat() if isinstance(value, datetime) else value for value in sort_key)
+    return urlsafe_b64encode(json.dumps(sort_key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+TCursorValue = Callable[[Any], Any]  # parses a decoded sort key value, raises ValueError for a wrong type
+
+
+def cursor_time(value: Any) -> datetime:
+    """:return: the time of a cursor value created from a `datetime`"""
+    if not isinstance(value, str):
+        raise ValueError('not a time')
+    return datetime.fromisoformat(value)
+
+
+def cursor_float(value: Any) -> float:
+    """:return: the number of a cursor value"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('not a number')
+    return float(value)
+
+
+def cursor_int(value: Any) -> int:
+    """:return: the integer of a cursor value"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('not an integer')
+    return value
+
+
+def decode_cursor(cursor: str, value_types: Sequence[TCursorValue]) -> Sequence[Any]:
+    """
+    :param cursor: the cursor as created by `encode_cursor`
+    :param value_types: parser for each expected sort key value, see `ActivityQueryBuilder.sort_key_types`
+    :return: the sort key values of the cursor
+    :raise ValueError: if the cursor is malformed or does not belong to the sort key, e.g. a time cursor of a search
+    """
+    try:
+        sort_key = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(sort_key, list) or len(sort_key) != len(value_types):
+            raise ValueError('wrong length')
+        return [value_type(value) for value_type, value in zip(value_types, sort_key)]
+    except (BinasciiError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+class ActivityQueryBuilder(object):
+    """
+    Composes the `Data` query for activity listings out of optional filters. Filters on the tag and language relations
+    are emitted as EXISTS semi joins, i.e. they can be combined freely without duplicating rows, which would count
+    against the limit.
+    """
+
+    def __init__(self, user_id: int) -> None:
+        """
+        :param user_id: the user whose activities are listed, only her sources, tags and tagsets are considered
+        """
+        self._user_id = user_id
+        self._criteria: List[ClauseElement] = [Data.source_id.in_(current_user_dao.ownership.source_ids)]
+        self._time_criteria: List[ClauseElement] = []
+        self._ts_query: Optional[ColumnElement] = None
+
+    def sources(self, source_ids: Optional[Iterable[int]]) -> 'ActivityQueryBuilder':
+        """:param source_ids: only include activities of these sources"""
+        if source_ids:
+            self._criteria.append(Data.source_id.in_(tuple(source_ids)))
+        return self
+
+    def max_object_id(self, max_id: Optional[str]) -> 'ActivityQueryBuilder':
+        """:param max_id: only include activities with a smaller object id"""
+        if max_id:
+            self._criteria.append(Data.object_id < max_id)
+        return self
+
+    def time_range(self, since: Optional[str], until: Optional[str]) -> 'ActivityQueryBuilder':
+        """
+        :param since: only include activities created at or after this time
+        :param until: only include activities created at or before this time
+        """
+        if since:
+            self._time_criteria.append(Time.time >= since)
+        if until:
+            self._time_criteria.append(Time.time <= until)
+        return self
+
+    def tagsets(self, tagset_ids: Optional[Iterable[int]]) -> 'ActivityQueryBuilder':
+        """:param tagset_ids: only include activities tagged with a tag of one of these tagsets"""
+        if tagset_ids:
+            self._criteria.append(exists().where(and_(
+                Tagging.data_id == Data.id,
+                TagTagSet.tag_id == Tagging.tag_id,
+                TagTagSet.tagset_id.in_(tuple(tagset_ids)),
+                TagSetUser.tagset_id == TagTagSet.tagset_id,
+                TagSetUser.user_id == self._user_id)))
+        return self
+
+    def tags(self, tags: Optional[Iterable[str]]) -> 'ActivityQueryBuilder':
+        """:param tags: only include activities tagged with one of these tags"""
+        if tags:
+            self._criteria.append(exists().where(and_(
+                Tagging.data_id == Data.id,
+                Tag.id == Tagging.tag_id,
+                Tag.tag.in_(tuple(tags)),
+                TagUser.tag_id == Tag.id,
+                TagUser.user_id == self._user_id)))
+        return self
+
+    def languages(self, languages: Optional[Iterable[str]]) -> 'ActivityQueryBuilder':
+        """:param languages: only include activities in one of these languages"""
+        if languages:
+            self._criteria.append(exists().where(and_(
+                Language.data_id == Data.id,
+                Language.language.in_(tuple(languages)))))
+        return self
+
+    def search(self, q: Optional[str]) -> 'ActivityQueryBuilder':
+        """:param q: only include activities whose text matches this full text query, sorts by relevance"""
+        if q:
+            self._ts_query = func.plainto_tsquery(_TS_CONFIG, q)
+        return self
+
+    @property
+    def sort_key(self) -> Tuple[ColumnElement, ColumnElement]:
+        """
+        :return: the unique key to sort the listing by (descending), relevance for searches, time otherwise. Both
+                 columns of the time key belong to the same table, i.e. the cursor comparison is an index condition
+                 on (time, data_id) instead of a join filter.
+        """
+        if self._ts_query is not None:
+            # real by default, its rounded text form in the cursor would not compare equal to the computed rank
+            return cast(func.ts_rank(_TEXT_VECTOR, self._ts_query), Float(53)), Data.id
+        return Time.time, Time.data_id
+
+    @property
+    def sort_key_types(self) -> Tuple[TCursorValue, TCursorValue]:
+        """:return: the parsers of the cursor values for `sort_key`"""
+        if self._ts_query is not None:
+            return cursor_float, cursor_int
+        return cursor_time, cursor_int
+
+    def query(self, ordered: bool = True) -> Query:
+        """
+        :param ordered: join the tables needed for `sort_key`
+        :return: the composed query
+        """
+        data_query = db.session.query(Data)
+        if (ordered and self._ts_query is None) or self._time_criteria:
+            data_query = data_query.join(Time, Time.data_id == Data.id)
+        if self._ts_query is not None:
+            data_query = (data_query
+                          .join(Text, Text.data_id == Data.id)
+                          .filter(_TEXT_VECTOR.op('@@')(self._ts_query)))
+        return data_query.filter(and_(*self._criteria, *self._time_criteria))
+
+
 class ActivityParser(object):
     """Activity parsing, i.e. converting them into the format expected by the Swagger definition"""
-    _best_models_for_user_sql = text('''
-    SELECT id FROM (
-    SELECT DISTINCT ON (tagset_id, sources)
-        model.id, model.score, model.trained_ts, model.tagset_id, jsonb_agg(DISTINCT src_mdl.source_id ORDER BY src_mdl.source_id) AS sources
-    FROM activity.model AS model
-    JOIN activity.source_model AS src_mdl ON src_mdl.model_id = model.id
-    JOIN activity.model_user AS model_user ON model_user.model_id = model.id
-    WHERE model_user.user_id = :user_id 
-    GROUP BY model.tagset_id, model.id, model.score, model.trained_ts
-    ORDER BY model.tagset_id, sources, score DESC, model.trained_ts DESC) AS best_models''')
-
-    @classmethod
-    def _common(cls, data: Data) -> Dict[str, Any]:
-        # todo for large amount of rows this is very inefficient
+
+    @staticmethod
+    def eager(query: Query) -> Query:
+        """
+        :param query: a query yielding `Data` objects
+        :return: the query with the scalar relations needed for parsing joined in, avoids one query per row
+        """
+        return query.options(joinedload(Data.text),
+                             joinedload(Data.source),
+                             joinedload(Data.time),
+                             joinedload(Data.language))
+
+    @staticmethod
+    def _tags_by_data_id(data_ids: List[int]) -> DefaultDict[int, List[str]]:
+        tags_by_data_id: DefaultDict[int, List[str]] = defaultdict(list)
+        tags_query = (db.session.query(Tagging.data_id, Tag.tag)
+                      .join(Tag, Tag.id == Tagging.tag_id)
+                      .filter(Tagging.data_id.in_(data_ids)))
+        for data_id, tag in tags_query:
+            tags_by_data_id[data_id].append(tag)
+        return tags_by_data_id
+
+    @staticmethod
+    def _predictions_by_data_id(data_ids: List[int]) -> DefaultDict[int, Dict[str, float]]:
+        predictions_by_data_id: DefaultDict[int, Dict[str, float]] = defaultdict(dict)
+        tagset_id_by_model_id = dict((best_model.model_id, best_model.tagset_id)
+                                     for best_model in best_models_for_user(current_user_dao.user_id))
+        if not tagset_id_by_model_id:
+            return predictions_by_data_id
+
+        predictions = (db.session.query(Prediction.data_id, Prediction.model_id, Prediction.prediction)
+                       .filter(Prediction.data_id.in_(data_ids))
+                       .filter(Prediction.model_id.in_(list(tagset_id_by_model_id.keys())))
+                       .all())
+
+        for data_id, model_id, prediction in predictions:
+            tag_names = tag_dictionary.names(tagset_id_by_model_id[str(model_id)],
+                                             (tag_id for tag_id, _ in prediction))
+            predictions_by_data_id[data_id].update((tag_names[tag_id], score)
+                                                   for tag_id, score in prediction if tag_id in tag_names)
+        return predictions_by_data_id
+
+    @staticmethod
+    def _common(data: Data, tags: List[str], prediction: Dict[str, float]) -> Dict[str, Any]:
         return dict(text=data.text.text if data.text else "",
-                    source=dict(id=data.source.id,
-                                type=data.source.type,
-                                uri=data.source.uri,
-                                slug=data.source.slug),
-                    tags=[tag.tag for tag in data.tags],
+                    source=source_to_json(data.source),
+                    tags=tags,
                     created_time=data.time.time.isoformat() if data.time else '1970-01-01T00:00:00+00:00',
                     language=data.language.language.name if data.language else Lang.un.name,
-                    prediction=dict(
-                        (prediction.model.tags.filter_by(id=k).one().tag, v)
-                        for prediction in data.predictions.filter(
-                            Prediction.model_id.in_(
-                                cls._best_models_for_user_sql.bindparams(user_id=current_user_dao.user_id)))
-                        for k, v in prediction.prediction)
-                    if data.predictions else dict())
+                    prediction=prediction)
 
     @staticmethod
     def _facebook(data: Data) -> Dict[str, Any]:
@@ -90,18 +317,40 @@ class ActivityParser(object):
                     user=dict(id=str(data.data['user']['id']),
                               name=data.data['user']['id']))
 
-    def __call__(self, data: Data) -> Dict[str, Any]:
-        """
-        :param data: the `Data` object to convert
-        :return: a dict corresponding to the Swagger specification
-        """
+    def _specific(self, data: Data) -> Dict[str, Any]:
         data_type = Type(data.source.type)
         parser_name = '_' + data_type.name
         assert hasattr(self, parser_name)
         parser: Callable[[Data], Dict[str, Any]] = getattr(self, parser_name)
+        return parser(data)
+
+    def parse_all(self, data: Iterable[Data]) -> List[Dict[str, Any]]:
+        """
+        Convert a whole page of activities at once. The tags and predictions are loaded with one query each for all
+        rows instead of one query per row, use `ActivityParser.eager` on the query to also batch the scalar relations.
+        :param data: the `Data` objects to convert
+        :return: a list of dicts corresponding to the Swagger specification, in the same order as `data`
+        """
+        data = list(data)
+        if not data:
+            return []
+        data_ids = [datum.id for datum in data]
+        tags_by_data_id = self._tags_by_data_id(data_ids)
+        predictions_by_data_id = self._predictions_by_data_id(data_ids)
+
+        parsed_data = []
+        for datum in data:
+            parsed = self._common(datum, tags_by_data_id[datum.id], predictions_by_data_id[datum.id])
+            parsed.update(self._specific(datum))
+            parsed_data.append(parsed)
+        return parsed_data
 
-        parsed = self._common(data)
-        parsed.update(parser(data))
+    def __call__(self, data: Data) -> Dict[str, Any]:
+        """
+        :param data: the `Data` object to convert
+        :return: a dict corresponding to the Swagger specification
+        """
+        parsed, = self.parse_all([data])
         return parsed
 
 
@@ -111,3 +360,63 @@ _ACTIVITY_PARSER = ActivityParser()
 def parse(data: Data) -> Dict[str, Any]:
     """ Helper method to invoke the default activity parse, see `ActivityParser.__call__` """
     return _ACTIVITY_PARSER(data)
+
+
+def parse_all(data: Iterable[Data]) -> List[Dict[str, Any]]:
+    """ Helper method to invoke the default batch activity parse, see `ActivityParser.parse_all` """
+    return _ACTIVITY_PARSER.parse_all(data)
+
+
+class ImportDto(NamedTuple):
+    """DTO for activity imports"""
+    source_id: int
+    object_id: str
+    data: TJson
+
+
+_IMPORT_CHUNK_SIZE = 1000
+
+
+def _new_activities(activities: List[ImportDto]) -> List[ImportDto]:
+    """
+    Skip activities that already exist. Only the ones the bloom filter reports as possibly known are checked against
+    the database, all in one query.
+    """
+    maybe_known = [activity
+                   for activity, known in zip(activities, activity_bloom_filter.might_contain(
+                       [(activity.source_id, activity.object_id) for activity in activities]))
+                   if known]
+    if not maybe_known:
+        return activities
+    existing = set(db.session.query(Data.source_id, Data.object_id).filter(
+        tuple_(Data.source_id, Data.object_id).in_([(activity.source_id, activity.object_id)
+                                                    for activity in maybe_known])))
+    return [activity for activity in activities if (activity.source_id, activity.object_id) not in existing]
+
+
+def insert_activities(activities: Iterable[ImportDto], chunk_size: int = _IMPORT_CHUNK_SIZE) -> int:
+    """
+    Insert activities using multi row INSERT ... ON CONFLICT DO NOTHING statements, i.e. one round trip per chunk.
+    Activities that already exist are skipped, known ones are filtered out by `activity_bloom_filter` beforehand.
+    The caller is responsible for checking the source ownership and for committing.
+    :param activities: the activities to insert
+    :param chunk_size: number of activities per statement
+    :return: number of actually inserted activities
+    """
+    data_table = Data.__table__
+    activities_iter = iter(activities)
+    inserted = 0
+    while True:
+        chunk = list(islice(activities_iter, chunk_size))
+        if not chunk:
+            return inserted
+        new_activities = _new_activities(chunk)
+        if new_activities:
+            insert_sql = (insert(data_table)
+                          .values([dict(source_id=activity.source_id,
+                                        object_id=activity.object_id,
+                                        data=activity.data) for activity in new_activities])
+                          .on_conflict_do_nothing()
+                          .returning(data_table.c.id))
+            inserted += len(db.session.execute(insert_sql).fetchall())
+        activity_bloom_filter.add((activity.source_id, activity.object_id) for activity in chunk)
@@ -0,0 +1,97 @@
+""" Per-user index of the best models, i.e. the best model for each trained (tagset, sources) combination """
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from ...flask_modules.cache import cache
+from ...flask_modules.database import db
+
+_BEST_MODELS_TIMEOUT = 60 * 60
+
+
+class BestModel(NamedTuple):
+    """Entry of the best models index"""
+    model_id: str
+    tagset_id: int
+    source_ids: Tuple[int, ...]
+    score: float
+    trained_ts: datetime
+
+
+_BEST_MODELS_FOR_USER_SQL = text('''
+SELECT DISTINCT ON (tagset_id, sources)
+    model.id, model.tagset_id, jsonb_agg(DISTINCT src_mdl.source_id ORDER BY src_mdl.source_id) AS sources,
+    model.score, model.trained_ts
+FROM activity.model AS model
+JOIN activity.source_model AS src_mdl ON src_mdl.model_id = model.id
+JOIN activity.model_user AS model_user ON model_user.model_id = model.id
+WHERE model_user.user_id = :user_id
+GROUP BY model.tagset_id, model.id, model.score, model.trained_ts
+ORDER BY model.tagset_id, sources, score DESC, model.trained_ts DESC''')
+
+
+def _version_key(user_id: int) -> str:
+    return 'best_models:%d:version' % user_id
+
+
+def _best_models_key(user_id: int) -> str:
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), uuid4().hex)
+        version = cache.get(_version_key(user_id))
+    return 'best_models:%d:%s' % (user_id, version)
+
+
+def invalidate_best_models(user_id: int) -> None:
+    """
+    Invalidate the index of the user, has to be called whenever the models of the user change, i.e. a training job
+    finished or the model ownership changed
+    :param user_id: the user whose index is invalidated
+    """
+    cache.set(_version_key(user_id), uuid4().hex)
+
+
+def best_models_for_user(user_id: int) -> List[BestModel]:
+    """
+    The index is computed once per version and cached, see `invalidate_best_models`.
+    :param user_id: the user to fetch the index for
+    :return: the best model for each (tagset, sources) combination the user has access to
+    """
+    key = _best_models_key(user_id)
+    best_models = cache.get(key)
+    if best_models is None:
+        best_models = [BestModel(model_id=str(model_id),
+                                 tagset_id=tagset_id,
+                                 source_ids=tuple(sources),
+                                 score=score,
+                                 trained_ts=trained_ts)
+                       for model_id, tagset_id, sources, score, trained_ts
+                       in db.session.execute(_BEST_MODELS_FOR_USER_SQL, dict(user_id=user_id))]
+        cache.set(key, best_models, timeout=_BEST_MODELS_TIMEOUT)
+    return best_models
+
+
+def _rank(model: BestModel) -> Tuple[bool, float, bool, datetime]:
+    # same order as `score DESC, trained_ts DESC` in postgres, i.e. NULLs first
+    return (model.score is None, model.score or 0.0,
+            model.trained_ts is None, model.trained_ts or datetime.min)
+
+
+def best_model_for_query(user_id: int,
+                         tagset_id: Optional[int],
+                         source_ids: Optional[Iterable[int]]) -> Optional[BestModel]:
+    """
+    Resolved from the best models index instead of ranking all models of the user. The best model of a query is the
+    best of the indexed models matching it, as all models of a (tagset, sources) combination match alike.
+    :param user_id: the user to look up the model for
+    :param tagset_id: the tagset the model has to be trained for, if any
+    :param source_ids: the model has to be trained on at least one of these sources, if any
+    :return: the best matching model or None
+    """
+    wanted_source_ids = frozenset(source_ids or ())
+    matching = [model for model in best_models_for_user(user_id)
+                if (not tagset_id or model.tagset_id == tagset_id) and
+                (not wanted_source_ids or not wanted_source_ids.isdisjoint(model.source_ids))]
+    return max(matching, key=_rank, default=None)
@@ -0,0 +1,68 @@
+""" Helpers for detecting duplicate activities before they reach the database """
+import json
+from hashlib import blake2b
+from typing import Any, Iterable, List, Tuple
+
+from ...flask_modules.redis import redis_store
+
+TActivityKey = Tuple[int, str]
+
+
+def content_id(data: Any) -> str:
+    """
+    Stable id for activities without an id of their own, identical content yields the same id in every process.
+    :param data: the JSON compatible activity data
+    :return: hex digest of the canonical JSON representation of `data`
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ActivityBloomFilter(object):
+    """
+    Probabilistic membership filter of the imported activity ids, one redis bitmap per source.
+    A negative answer is definite, a positive one has to be verified (false positive rate ~1% at 1.7M ids per source
+    with the default parameters).
+    """
+
+    def __init__(self, size: int = 2 ** 24, hashes: int = 7) -> None:
+        """
+        :param size: number of bits per source
+        :param hashes: number of bits set per id
+        """
+        self._size = size
+        self._hashes = hashes
+
+    @staticmethod
+    def _key(source_id: int) -> str:
+        return 'activity_bloom:%d' % source_id
+
+    def _offsets(self, object_id: str) -> List[int]:
+        # double hashing, see Kirsch & Mitzenmacher "Less Hashing, Same Performance"
+        digest = blake2b(object_id.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self._size for i in range(self._hashes)]
+
+    def add(self, keys: Iterable[TActivityKey]) -> None:
+        """:param keys: (source_id, object_id) of activities known to exist"""
+        pipeline = redis_store.pipeline(transaction=False)
+        for source_id, object_id in keys:
+            for offset in self._offsets(object_id):
+                pipeline.setbit(self._key(source_id), offset, 1)
+        pipeline.execute()
+
+    def might_contain(self, keys: List[TActivityKey]) -> List[bool]:
+        """
+        :param keys: (source_id, object_id) of activities to check
+        :return: for each key whether the activity might already exist, all lookups use a single round trip
+        """
+        pipeline = redis_store.pipeline(transaction=False)
+        for source_id, object_id in keys:
+            for offset in self._offsets(object_id):
+                pipeline.getbit(self._key(source_id), offset)
+        bits = pipeline.execute()
+        return [all(bits[i:i + self._hashes]) for i in range(0, len(bits), self._hashes)]
+
+
+activity_bloom_filter = ActivityBloomFilter()
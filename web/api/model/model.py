@@ -1,9 +1,14 @@
 """ Models and helpers for model api """
-from typing import Any, Dict, Iterable, NamedTuple, Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
 
-from common.db.models.brain import Model
+from sqlalchemy import text as sql_text
+
+from common.db.models.activities import Source, Tag, TagSet, TagTagSet
+from common.db.models.brain import Model, ModelUser
+from . import table_names
 from .activities import source_to_json, tagset_to_json
 from ...flask_modules import TJson
+from ...flask_modules.database import db
 from ...flask_modules.jwt import is_admin
 
 
@@ -23,6 +28,51 @@ def model_to_json(model: Model) -> Dict[str, Any]:
     return result
 
 
+_MODELS_FOR_USER_SQL = sql_text("""
+SELECT model.id, model.trained_ts, model.score, model.params, tagset.id, tagset.title,
+    ARRAY(SELECT tag.tag
+          FROM %(tag_tagset_table)s as tag_tagset
+          JOIN %(tag_table)s as tag ON tag.id = tag_tagset.tag_id
+          WHERE tag_tagset.tagset_id = tagset.id
+          ORDER BY tag.tag) as tags,
+    ARRAY(SELECT json_build_object('id', source.id, 'type', source.type, 'uri', source.uri, 'slug', source.slug)
+          FROM activity.source_model as src_mdl
+          JOIN %(source_table)s as source ON source.id = src_mdl.source_id
+          WHERE src_mdl.model_id = model.id
+          ORDER BY source.id) as sources
+FROM %(model_table)s as model
+JOIN %(model_user_table)s as model_user ON model_user.model_id = model.id AND model_user.user_id = :user_id
+JOIN %(tagset_table)s as tagset ON tagset.id = model.tagset_id
+ORDER BY model.trained_ts DESC
+""" % table_names(model_table=Model,
+                  model_user_table=ModelUser,
+                  tagset_table=TagSet,
+                  tag_tagset_table=TagTagSet,
+                  tag_table=Tag,
+                  source_table=Source))
+
+
+def models_for_user_json(user_id: int) -> List[Dict[str, Any]]:
+    """
+    :param user_id: the user to list the models for
+    :return: all models of the user like `model_to_json`, loaded including tagsets and sources with a single query
+    """
+    with_restricted = is_admin()
+    models = []
+    for model_id, trained_ts, score, params, tagset_id, title, tags, sources in db.session.execute(
+            _MODELS_FOR_USER_SQL, dict(user_id=user_id)):
+        result = dict(
+            id=str(model_id),
+            trained_ts=trained_ts,
+            tagset=dict(id=tagset_id, title=title, tags=tags),
+            sources=sources)
+        if with_restricted:
+            result['score'] = score
+            result['params'] = params
+        models.append(result)
+    return models
+
+
 class ModelQueryDto(NamedTuple):
     """DTO for model queries"""
     tagset_id: Optional[int]
@@ -0,0 +1,188 @@
+""" Dispatching and caching of predictions of the brain workers """
+import json
+from hashlib import blake2b
+from threading import Event, Lock
+from time import sleep, time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from common.config import get_config
+from ...flask_modules.celery import TResult, brain
+from ...flask_modules.redis import redis_store
+
+_CONFIG = get_config()
+
+TPredictionKey = Tuple[str, str]  # (model id, text)
+TPrediction = List[Tuple[int, float]]  # (tag id, score) as returned by the brain workers
+
+
+def predict_texts(predictions: Sequence[TPredictionKey]) -> List[TResult]:
+    """
+    Dispatch many predictions at once, i.e. all tasks are published over a single producer connection.
+    Identical (model, text) pairs are only sent once.
+    :param predictions: (model id, text) pairs
+    :return: the pending result for each pair, in order
+    """
+    unique = list(dict.fromkeys(predictions))
+    by_prediction = dict(zip(unique, brain.predict_text.send_many(unique)))
+    return [by_prediction[prediction] for prediction in predictions]
+
+
+class _Batch(object):
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('model_id', 'texts', 'results', 'error', 'dispatched')
+
+    def __init__(self, model_id: str) -> None:
+        self.model_id = model_id
+        self.texts: Dict[str, int] = dict()
+        self.results: List[TResult] = []
+        self.error: Optional[Exception] = None
+        self.dispatched = Event()
+
+
+class PredictionBatcher(object):
+    """
+    Coalesces the single predictions of concurrent requests (threads) of this process. The first request for a model
+    opens a batch and dispatches it after `window` seconds, requests for the same model arriving in the meantime are
+    added to it. Every prediction is still a task of its own, the batch shares the producer connection only. It only
+    pays off for many concurrent requests per process, a window of 0 (the default) disables batching.
+    """
+
+    def __init__(self, window: float, max_size: int = 64, dispatch_timeout: float = 1.0) -> None:
+        """
+        :param window: seconds the first request of a batch waits for others
+        :param max_size: number of texts at which a batch is dispatched right away
+        :param dispatch_timeout: seconds the other requests wait for the dispatch before dispatching on their own
+        """
+        self._window = window
+        self._max_size = max_size
+        self._dispatch_timeout = dispatch_timeout
+        self._lock = Lock()
+        self._batches: Dict[str, _Batch] = dict()
+
+    def _dispatch(self, batch: _Batch) -> None:
+        with self._lock:  # whoever removes the batch dispatches it, i.e. the leader or the request filling it up
+            if self._batches.get(batch.model_id) is not batch:
+                return
+            del self._batches[batch.model_id]
+        try:
+            batch.results = predict_texts([(batch.model_id, text) for text in batch.texts])
+        except Exception as err:  # waiting requests have to be notified either way pylint: disable=broad-except
+            batch.error = err
+        batch.dispatched.set()
+
+    def predict(self, model_id: str, text: str) -> TResult:
+        """
+        :param model_id: the model to predict with
+        :param text: the text to predict
+        :return: the pending result of the prediction
+        """
+        if self._window <= 0:
+            return predict_texts([(model_id, text)])[0]
+
+        with self._lock:
+            batch = self._batches.get(model_id)
+            leader = batch is None
+            if leader:
+                batch = self._batches[model_id] = _Batch(model_id)
+            index = batch.texts.setdefault(text, len(batch.texts))
+            full = len(batch.texts) >= self._max_size
+
+        if full:
+            self._dispatch(batch)
+        elif leader:
+            sleep(self._window)
+            self._dispatch(batch)
+        elif not batch.dispatched.wait(self._window + self._dispatch_timeout):
+            return predict_texts([(model_id, text)])[0]  # the leader got stuck
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+
+prediction_batcher = PredictionBatcher(window=_CONFIG.getfloat('CELERY', 'prediction_batch_window', fallback=0.0))
+
+
+class PredictionCache(object):
+    """
+    Cache of finished predictions in redis, keyed by model id and text digest. A retrained model gets a new id, so
+    entries never have to be invalidated. Entries expire `ttl` seconds after they were last used, beyond `max_size`
+    entries the least recently used ones are evicted.
+    """
+
+    _LRU_KEY = 'prediction_cache:lru'
+    _STATS_KEY = 'prediction_cache:stats'
+
+    def __init__(self, max_size: int, ttl: int) -> None:
+        """
+        :param max_size: maximum number of cached predictions
+        :param ttl: seconds after which a prediction expires
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+
+    @staticmethod
+    def _key(model_id: str, text: str) -> str:
+        return 'prediction_cache:%s:%s' % (model_id, blake2b(text.encode('utf-8'), digest_size=16).hexdigest())
+
+    def get_many(self, predictions: Sequence[TPredictionKey]) -> List[Optional[TPrediction]]:
+        """
+        :param predictions: (model id, text) pairs to look up
+        :return: for each pair the cached prediction or None
+        """
+        if not predictions:
+            return []
+        keys = [self._key(model_id, text) for model_id, text in predictions]
+        values = redis_store.mget(keys)
+        hits = [key for key, value in zip(keys, values) if value is not None]
+
+        pipeline = redis_store.pipeline(transaction=False)
+        if hits:
+            # keeps key expiry and LRU score in step, the score is used to drop expired keys from the LRU set
+            pipeline.zadd(self._LRU_KEY, dict.fromkeys(hits, time()))
+            for key in hits:
+                pipeline.expire(key, self._ttl)
+        pipeline.hincrby(self._STATS_KEY, 'hits', len(hits))
+        pipeline.hincrby(self._STATS_KEY, 'misses', len(keys) - len(hits))
+        pipeline.execute()
+        return [json.loads(value) if value is not None else None for value in values]
+
+    def set_many(self, predictions: Sequence[TPredictionKey], results: Sequence[TPrediction]) -> None:
+        """
+        :param predictions: (model id, text) pairs that were predicted
+        :param results: the prediction for each pair
+        """
+        if not predictions:
+            return
+        now = time()
+        pipeline = redis_store.pipeline(transaction=False)
+        for (model_id, text), result in zip(predictions, results):
+            key = self._key(model_id, text)
+            pipeline.setex(key, self._ttl, json.dumps(result))
+            pipeline.zadd(self._LRU_KEY, {key: now})
+        pipeline.zremrangebyscore(self._LRU_KEY, '-inf', now - self._ttl)  # expired ones
+        pipeline.zcard(self._LRU_KEY)
+        *_, size = pipeline.execute()
+
+        if size > self._max_size:
+            evicted = redis_store.zrange(self._LRU_KEY, 0, size - self._max_size - 1)
+            if evicted:
+                pipeline = redis_store.pipeline(transaction=False)
+                pipeline.delete(*evicted)
+                pipeline.zrem(self._LRU_KEY, *evicted)
+                pipeline.execute()
+
+    def stats(self) -> Dict[str, float]:
+        """:return: hits, misses, hit ratio and size of the cache"""
+        counters = dict((name.decode('utf-8'), int(value))
+                        for name, value in redis_store.hgetall(self._STATS_KEY).items())
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return dict(hits=hits,
+                    misses=misses,
+                    hit_ratio=hits / (hits + misses) if hits + misses else 0.0,
+                    size=redis_store.zcard(self._LRU_KEY),
+                    max_size=self._max_size,
+                    ttl=self._ttl)
+
+
+prediction_cache = PredictionCache(max_size=_CONFIG.getint('CELERY', 'prediction_cache_size', fallback=100000),
+                                   ttl=_CONFIG.getint('CELERY', 'prediction_cache_ttl', fallback=60 * 60 * 24))
@@ -0,0 +1,120 @@
+""" Models and helpers for tags api """
+from typing import Dict, Iterable, Optional
+from uuid import uuid4
+
+from flask import g
+from sqlalchemy import BigInteger, Column, DDL, ForeignKey, Integer, event
+
+from common.db import Base
+from common.db.models.activities import Tag, TagTagSet, Tagging
+from ...flask_modules.cache import cache
+from ...flask_modules.database import db
+
+
+class TagDictionary(object):
+    """
+    Process local tag id -> tag name lookup, bulk loaded per tagset. Used to render predictions without querying the
+    tags for every prediction.
+    The dictionary is versioned via the cache, `invalidate` drops the local copies of all processes. The version is
+    checked once per request (application context), lookups are pure in-memory afterwards.
+    """
+
+    _VERSION_KEY = 'tag_dictionary:version'
+
+    def __init__(self) -> None:
+        self._version: Optional[str] = None
+        self._tagsets: Dict[int, Dict[int, str]] = dict()
+
+    def _sync(self) -> None:
+        if g.get('tag_dictionary_synced'):
+            return
+        g.tag_dictionary_synced = True
+        version = cache.get(self._VERSION_KEY)
+        if version is None:
+            cache.add(self._VERSION_KEY, uuid4().hex)
+            version = cache.get(self._VERSION_KEY)
+        if version != self._version:
+            self._tagsets = dict()
+            self._version = version
+
+    def names(self, tagset_id: int, tag_ids: Iterable[int] = ()) -> Dict[int, str]:
+        """
+        :param tagset_id: the tagset the tag ids belong to, e.g. the tagset of a model
+        :param tag_ids: tag ids which should be resolved, ones no longer in the tagset are loaded individually
+        :return: tag id -> tag name dictionary for the tagset
+        """
+        self._sync()
+        tags = self._tagsets.get(tagset_id)
+        if tags is None:
+            tags = dict(db.session.query(Tag.id, Tag.tag)
+                        .join(TagTagSet, TagTagSet.tag_id == Tag.id)
+                        .filter(TagTagSet.tagset_id == tagset_id))
+            self._tagsets[tagset_id] = tags
+        missing = set(tag_ids).difference(tags)
+        if missing:
+            tags.update(db.session.query(Tag.id, Tag.tag).filter(Tag.id.in_(missing)))
+        return tags
+
+    def invalidate(self) -> None:
+        """Invalidate the dictionary, has to be called whenever tags or tagsets change"""
+        version = uuid4().hex
+        cache.set(self._VERSION_KEY, version)
+        self._tagsets = dict()
+        self._version = version
+
+
+tag_dictionary = TagDictionary()
+
+
+class TagCount(Base):
+    """
+    Number of taggings per tag. Maintained by a trigger on the tagging table, so every write path (single and bulk
+    tagging, deletes) keeps it exact. Tags without a row have not been used. Table and trigger are created by the
+    migrations, see `web.api.migrate`.
+    """
+    # pylint: disable=too-few-public-methods
+    __tablename__ = 'tag_count'
+    __table_args__ = dict(schema=Tag.__table__.schema)
+
+    tag_id = Column(Integer, ForeignKey(Tag.id, ondelete='CASCADE'), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+_TAG_COUNT_NAMES = dict(tag_count_table=TagCount.__table__.fullname,
+                        tag_table=Tag.__table__.fullname,
+                        tagging_table=Tagging.__table__.fullname,
+                        schema_prefix=Tag.__table__.schema + '.' if Tag.__table__.schema else '')
+
+# idempotent, i.e. can be applied to existing databases as well
+TAG_COUNT_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS %(tag_count_table)s (
+    tag_id INTEGER NOT NULL REFERENCES %(tag_table)s (id) ON DELETE CASCADE,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (tag_id)
+);
+""" % _TAG_COUNT_NAMES
+
+TAG_COUNT_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION %(schema_prefix)stag_count_update() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO %(tag_count_table)s (tag_id, count) VALUES (NEW.tag_id, 1)
+        ON CONFLICT (tag_id) DO UPDATE SET count = %(tag_count_table)s.count + 1;
+    ELSE
+        UPDATE %(tag_count_table)s SET count = count - 1 WHERE tag_id = OLD.tag_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tagging_tag_count ON %(tagging_table)s;
+CREATE TRIGGER tagging_tag_count AFTER INSERT OR DELETE ON %(tagging_table)s
+FOR EACH ROW EXECUTE PROCEDURE %(schema_prefix)stag_count_update();
+
+-- backfill the existing taggings
+INSERT INTO %(tag_count_table)s (tag_id, count)
+SELECT tag_id, count(*) FROM %(tagging_table)s GROUP BY tag_id
+ON CONFLICT (tag_id) DO UPDATE SET count = excluded.count;
+""" % _TAG_COUNT_NAMES
+
+event.listen(TagCount.__table__, 'after_create', DDL(TAG_COUNT_TRIGGER_SQL))
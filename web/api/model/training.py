@@ -0,0 +1,56 @@
+""" Single-flight registry of the training jobs, so identical trainings are only queued once """
+from typing import Iterable, Tuple
+from uuid import uuid4
+
+from common.config import get_config
+from ...flask_modules.celery import task_result
+from ...flask_modules.redis import redis_store
+
+_CONFIG = get_config()
+# upper bound for a training, in case the release of the lease got lost
+_LEASE_TIMEOUT = _CONFIG.getint('CELERY', 'training_lease', fallback=60 * 60 * 6)
+_IN_FLIGHT_STATES = frozenset(('PENDING', 'RECEIVED', 'STARTED', 'RETRY'))
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def training_key(user_id: int, tagset_id: int, source_ids: Iterable[int]) -> str:
+    """
+    :param user_id: the user the model is trained for
+    :param tagset_id: the tagset the model is trained for
+    :param source_ids: the sources the model is trained on
+    :return: the lease key of the training, identical for identical trainings
+    """
+    return 'training:%d:%d:%s' % (user_id, tagset_id, ','.join(str(source_id) for source_id in sorted(set(source_ids))))
+
+
+def claim_training(key: str) -> Tuple[str, bool]:
+    """
+    :param key: the lease key, see `training_key`
+    :return: the job id of the training and whether it was claimed, i.e. it has to be started with this id. Otherwise
+             an identical training is already queued or running under this id.
+    """
+    while True:
+        job_id = str(uuid4())
+        if redis_store.set(key, job_id, nx=True, ex=_LEASE_TIMEOUT):
+            return job_id, True
+        running_job_id = redis_store.get(key)
+        if running_job_id is None:  # released in the meantime
+            continue
+        running_job_id = running_job_id.decode('utf-8')
+        if task_result(running_job_id).state in _IN_FLIGHT_STATES:
+            return running_job_id, False
+        release_training(key, running_job_id)  # finished, but the lease was not released
+
+
+def release_training(key: str, job_id: str) -> None:
+    """
+    Release the lease, if it is still held by the job
+    :param key: the lease key, see `training_key`
+    :param job_id: the job holding the lease
+    """
+    redis_store.eval(_RELEASE_SCRIPT, 1, key, job_id)
@@ -1,22 +1,145 @@
 """ Models and helpers for user api """
+from typing import Any, Callable, FrozenSet, NamedTuple
+from uuid import uuid4
+
+from flask import g
 from sqlalchemy.orm import Query
 
 from common.db.models.activities import Data, Source, SourceUser, Tag, TagSet, TagSetUser, TagUser
 from common.db.models.brain import Model, ModelUser
 from common.db.models.users import User
+from .best_models import invalidate_best_models
+from ...flask_modules.cache import cache
 from ...flask_modules.database import db
 from ...flask_modules.jwt import current_user_id
 
+_OWNERSHIP_TIMEOUT = 60 * 60
+
+
+def _version_key(user_id: int) -> str:
+    return 'ownership:%d:version' % user_id
+
+
+def invalidate_ownership(user_id: int) -> None:
+    """
+    Invalidate the ownership snapshot of any user, e.g. from a task; within a request use `Ownership.invalidate`
+    :param user_id: the user whose snapshot is invalidated
+    """
+    cache.set(_version_key(user_id), uuid4().hex)
+    invalidate_best_models(user_id)
+
+
+class OwnedIds(NamedTuple):
+    """Snapshot of the ids the user owns. Model ids are strings, see `BestModel`."""
+    source_ids: FrozenSet[int]
+    tag_ids: FrozenSet[int]
+    tagset_ids: FrozenSet[int]
+    model_ids: FrozenSet[str]
+
+
+class Ownership(object):
+    """
+    What the _current user_ owns, from a versioned `OwnedIds` snapshot in the cache. It is loaded lazily and at most
+    once per request, the entity queries filter on it instead of repeating the ownership subqueries.
+    Endpoints changing what a user owns have to call `invalidate`.
+    """
+
+    def __init__(self, user_dao: 'CurrentUserDao') -> None:
+        """:param user_dao: provides the queries the snapshot is built from"""
+        self._user_dao = user_dao
+
+    def _load(self, refresh: bool = False) -> OwnedIds:
+        """:param refresh: rebuild the snapshot of the current version from the database, e.g. if it might be stale"""
+        user_id = self._user_dao.user_id
+        version = cache.get(_version_key(user_id))
+        if version is None:
+            cache.add(_version_key(user_id), uuid4().hex)
+            version = cache.get(_version_key(user_id))
+        key = 'owned_ids:%d:%s' % (user_id, version)
+        owned_ids = None if refresh else cache.get(key)
+        if owned_ids is None:
+            user_dao = self._user_dao
+            owned_ids = OwnedIds(source_ids=frozenset(source_id for source_id, in user_dao.source_ids),
+                                 tag_ids=frozenset(tag_id for tag_id, in user_dao.tag_ids),
+                                 tagset_ids=frozenset(tagset_id for tagset_id, in user_dao.tagset_ids),
+                                 model_ids=frozenset(str(model_id) for model_id, in user_dao.model_ids))
+            cache.set(key, owned_ids, timeout=_OWNERSHIP_TIMEOUT)
+        return owned_ids
+
+    @property
+    def _owned_ids(self) -> OwnedIds:
+        if 'owned_ids' not in g:
+            g.owned_ids = self._load()
+        return g.owned_ids
+
+    def _owns(self, field: Callable[[OwnedIds], FrozenSet[Any]], entity_id: Any) -> bool:
+        """
+        In memory ownership check. On a miss the snapshot is rebuilt once per request, as it might be stale, e.g. a
+        training job finished in the meantime. The rebuilt one replaces the cached snapshot of the current version,
+        i.e. a miss (e.g. probing foreign ids) does not force the other requests of the user to reload it.
+        """
+        if entity_id in field(self._owned_ids):
+            return True
+        if g.get('ownership_refreshed'):
+            return False
+        g.ownership_refreshed = True
+        g.owned_ids = self._load(refresh=True)
+        return entity_id in field(g.owned_ids)
+
+    @property
+    def source_ids(self) -> FrozenSet[int]:
+        """:return: the ids of the sources the user owns"""
+        return self._owned_ids.source_ids
+
+    @property
+    def tag_ids(self) -> FrozenSet[int]:
+        """:return: the ids of the tags the user owns"""
+        return self._owned_ids.tag_ids
+
+    @property
+    def tagset_ids(self) -> FrozenSet[int]:
+        """:return: the ids of the tagsets the user owns"""
+        return self._owned_ids.tagset_ids
+
+    @property
+    def model_ids(self) -> FrozenSet[str]:
+        """:return: the ids of the models the user owns"""
+        return self._owned_ids.model_ids
+
+    def owns_source(self, source_id: int) -> bool:
+        """:return: whether the user owns the source"""
+        return self._owns(lambda owned_ids: owned_ids.source_ids, source_id)
+
+    def owns_tag(self, tag_id: int) -> bool:
+        """:return: whether the user owns the tag"""
+        return self._owns(lambda owned_ids: owned_ids.tag_ids, tag_id)
+
+    def owns_tagset(self, tagset_id: int) -> bool:
+        """:return: whether the user owns the tagset"""
+        return self._owns(lambda owned_ids: owned_ids.tagset_ids, tagset_id)
+
+    def owns_model(self, model_id: Any) -> bool:
+        """:return: whether the user owns the model, its id may be given as string or UUID"""
+        return self._owns(lambda owned_ids: owned_ids.model_ids, str(model_id))
+
+    def invalidate(self) -> None:
+        """Invalidate the snapshot, has to be called after changing what the user owns"""
+        invalidate_ownership(self._user_dao.user_id)
+        g.pop('owned_ids', None)
+
 
 class CurrentUserDao(object):
     """
     Helper DAO that creates DB queries for the properties of the _current user_.
-    The properties should be self explanatory.
+    The properties should be self explanatory, the owned ids are available via `ownership`.
     """
 
     # should be self explanatory pylint: disable=missing-docstring
     # false positive "no member query" pylint: disable=no-member
 
+    def __init__(self) -> None:
+        self.ownership = Ownership(self)
+
     @property
     def user_id(self) -> int:
         return current_user_id()
@@ -31,15 +154,15 @@ class CurrentUserDao(object):
 
     @property
     def sources(self) -> Query:
-        return db.session.query(Source).filter(Source.id.in_(self.source_ids))
+        return db.session.query(Source).filter(Source.id.in_(self.ownership.source_ids))
 
     @property
     def data_ids(self) -> Query:
-        return db.session.query(Data.id).filter(Data.source_id.in_(self.source_ids))
+        return db.session.query(Data.id).filter(Data.source_id.in_(self.ownership.source_ids))
 
     @property
     def data(self) -> Query:
-        return db.session.query(Data).filter(Data.source_id.in_(self.source_ids))
+        return db.session.query(Data).filter(Data.source_id.in_(self.ownership.source_ids))
 
     @property
     def tag_ids(self) -> Query:
@@ -47,7 +170,7 @@ class CurrentUserDao(object):
 
     @property
     def tags(self) -> Query:
-        return db.session.query(Tag).filter(Tag.id.in_(self.tag_ids))
+        return db.session.query(Tag).filter(Tag.id.in_(self.ownership.tag_ids))
 
     @property
     def created_tags(self) -> Query:
@@ -63,7 +186,7 @@ class CurrentUserDao(object):
 
     @property
     def tagsets(self) -> Query:
-        return db.session.query(TagSet).filter(TagSet.id.in_(self.tagset_ids))
+        return db.session.query(TagSet).filter(TagSet.id.in_(self.ownership.tagset_ids))
 
     @property
     def model_ids(self) -> Query:
@@ -71,7 +194,7 @@ class CurrentUserDao(object):
 
     @property
     def models(self) -> Query:
-        return db.session.query(Model).filter(Model.id.in_(self.model_ids))
+        return db.session.query(Model).filter(Model.id.in_(self.ownership.model_ids))
 
 
 current_user_dao = CurrentUserDao()
@@ -0,0 +1,83 @@
+"""
+`Celery` tasks executed on behalf of the API, e.g. long running imports.
+Run a worker for them via `celery -A web.api.tasks worker -Q web`.
+"""
+import json
+from itertools import islice
+from typing import Dict, Iterable
+from uuid import uuid4
+
+from celery import Task
+
+from .model.activities import ImportDto, insert_activities
+from .model.training import release_training
+from .model.user import invalidate_ownership
+from ..flask_modules.celery import celery
+from ..flask_modules.database import db
+from ..flask_modules.redis import redis_store
+
+_IMPORT_CHUNK_SIZE = 1000
+# staged imports not picked up by a worker in time are dropped
+_IMPORT_STAGING_TIMEOUT = 60 * 60 * 24
+
+
+def stage_import(activities: Iterable[ImportDto]) -> str:
+    """
+    Stage the activities of a background import as a redis list, so the task message only carries its key instead
+    of the whole payload.
+    :param activities: the activities to import
+    :return: the staging key to pass to `import_activities`
+    """
+    key = 'import_staging:%s' % uuid4().hex
+    activities_iter = iter(activities)
+    while True:
+        chunk = list(islice(activities_iter, _IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        pipeline = redis_store.pipeline(transaction=False)
+        pipeline.rpush(key, *(json.dumps(activity) for activity in chunk))
+        pipeline.expire(key, _IMPORT_STAGING_TIMEOUT)
+        pipeline.execute()
+    return key
+
+
+@celery.task(bind=True, name='web.api.tasks.import_activities', queue='web')
+def import_activities(self: Task, staging_key: str) -> Dict[str, int]:
+    """
+    Import the staged activities in chunks, reporting the progress via the task state. The staged activities are
+    removed afterwards.
+    The source ownership has to be checked before scheduling the task.
+    :param staging_key: the key returned by `stage_import`
+    :return: the final counts
+    """
+    total = redis_store.llen(staging_key)
+    processed = 0
+    accepted = 0
+    try:
+        while processed < total:
+            chunk = [ImportDto(*json.loads(activity))
+                     for activity in redis_store.lrange(staging_key, processed, processed + _IMPORT_CHUNK_SIZE - 1)]
+            if not chunk:  # expired in the meantime
+                break
+            accepted += insert_activities(chunk)
+            db.session.commit()
+            processed += len(chunk)
+            self.update_state(state='PROGRESS',
+                              meta=dict(total=total, processed=processed, accepted=accepted,
+                                        duplicates=processed - accepted))
+    finally:
+        redis_store.delete(staging_key)
+    return dict(total=total, processed=processed, accepted=accepted, duplicates=processed - accepted)
+
+
+@celery.task(name='web.api.tasks.release_training_lease', queue='web')
+def release_training_lease(key: str, job_id: str, user_id: int) -> None:
+    """
+    Callback of training jobs, releases their single-flight lease once they are finished. The new model changes what
+    the user owns, i.e. the ownership snapshot and the best models of the user.
+    :param key: the lease key
+    :param job_id: the training job
+    :param user_id: the user the model was trained for
+    """
+    release_training(key, job_id)
+    invalidate_ownership(user_id)
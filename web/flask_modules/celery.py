@@ -1,10 +1,18 @@
 """`Celery` background tasks module and Proxies"""
 from abc import ABC, abstractmethod
-from typing import Any, Callable, cast
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from importlib import import_module
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union, cast
+from uuid import uuid4
 
 from celery import Celery
+from celery.canvas import Signature
+from celery.exceptions import TimeoutError as ResultTimeoutError
 from celery.result import AsyncResult
-from flask import Flask
+from flask import Flask, has_app_context
 
 from common.config import get_config
 from . import FlaskModule
@@ -56,18 +64,263 @@ class FlaskCelery(FlaskModule, Celery):
 celery = FlaskCelery()
 
 
+class LocalResult(object):
+    """`AsyncResult` look-alike for tasks executed by the `LocalBackend`"""
+
+    def __init__(self, task_id: str, future: Future) -> None:
+        self.id = task_id  # pylint: disable=invalid-name
+        self._future = future
+
+    @property
+    def state(self) -> str:
+        """:return: the `Celery` state name of the task"""
+        if not self._future.done():
+            return 'STARTED' if self._future.running() else 'PENDING'
+        return 'FAILURE' if self._future.exception() is not None else 'SUCCESS'
+
+    @property
+    def result(self) -> Any:
+        """:return: the return value or exception of the task, None while it runs"""
+        if not self._future.done():
+            return None
+        return self._future.exception() or self._future.result()
+
+    info = result
+
+    def ready(self) -> bool:
+        """:return: whether the task has finished"""
+        return self._future.done()
+
+    def failed(self) -> bool:
+        """:return: whether the task has raised an exception"""
+        return self._future.done() and self._future.exception() is not None
+
+    def get(self, timeout: Optional[float] = None, propagate: bool = True) -> Any:
+        """same semantics as `AsyncResult.get`"""
+        try:
+            exception = self._future.exception(timeout)
+        except FutureTimeoutError as err:
+            raise ResultTimeoutError('The operation timed out.') from err
+        if exception is not None:
+            if propagate:
+                raise exception
+            return exception
+        return self._future.result()
+
+
+TResult = Union[AsyncResult, LocalResult]
+
+
+class LocalBackend(object):
+    """
+    Executes the tasks of the `Proxy` classes in process instead of sending them to the workers, by handlers
+    registered under the task names. Meant for load testing the web tier without broker and workers, see
+    `local_tasks` for deterministic stand-ins of the worker tasks.
+    """
+
+    _MAX_RESULTS = 10000
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._app: Optional[Flask] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._latency = 0.0
+        self._handlers: Dict[str, Callable[..., Any]] = dict()
+        self._lock = Lock()
+        self._results: Dict[str, LocalResult] = OrderedDict()
+
+    def init_app(self, app: Flask, workers: int, latency: float) -> None:
+        """
+        :param app: the `Flask` app, the handlers are executed in its context
+        :param workers: size of the thread pool, 0 executes the tasks synchronously while dispatching
+        :param latency: simulated seconds each task takes in addition to its handler
+        """
+        self._app = app
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._latency = latency
+        self.enabled = True
+
+    def register(self, task_name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        Decorator registering a handler for a task
+        :param task_name: full name of the task
+        """
+        def decorator(handler: Callable[..., Any]) -> Callable[..., Any]:
+            self._handlers[task_name] = handler
+            return handler
+
+        return decorator
+
+    def _call(self, task_name: str, args: Sequence[Any], kwargs: Dict[str, Any],
+              link_error: Optional[Signature]) -> Any:
+        try:
+            return self._handlers[task_name](*args, **kwargs)
+        except Exception:
+            if link_error is not None:
+                link_error.apply()
+            raise
+
+    def _run(self, task_name: str, args: Sequence[Any], kwargs: Dict[str, Any], options: Dict[str, Any]) -> Any:
+        if self._latency > 0:
+            sleep(self._latency)
+        link_error: Optional[Signature] = options.get('link_error')
+        if has_app_context():  # executed synchronously, e.g. by a request
+            result = self._call(task_name, args, kwargs, link_error)
+        else:
+            with cast(Flask, self._app).app_context():
+                result = self._call(task_name, args, kwargs, link_error)
+        link: Optional[Signature] = options.get('link')
+        if link is not None:
+            link.apply()
+        return result
+
+    def submit(self, task_name: str, args: Sequence[Any] = (), kwargs: Optional[Dict[str, Any]] = None,
+               **options: Any) -> LocalResult:
+        """
+        Execute a task, accepts the same options as `Celery.send_task` (only task_id, link and link_error are used)
+        :return: the result of the task
+        """
+        if task_name not in self._handlers:
+            raise ValueError(f"no local handler for task {task_name}")
+        run_args = (task_name, args, kwargs or dict(), options)
+        if self._executor is not None:
+            future = self._executor.submit(self._run, *run_args)
+        else:
+            future = Future()
+            try:
+                future.set_result(self._run(*run_args))
+            except Exception as err:  # pylint: disable=broad-except
+                future.set_exception(err)
+
+        result = LocalResult(options.get('task_id') or str(uuid4()), future)
+        with self._lock:
+            self._results[result.id] = result
+            if len(self._results) > self._MAX_RESULTS:
+                self._results.popitem(last=False)  # type: ignore
+        return result
+
+    def result(self, task_id: str) -> LocalResult:
+        """
+        :param task_id: id of a task executed by this backend
+        :return: its result, pending forever if unknown like `AsyncResult`
+        """
+        with self._lock:
+            result = self._results.get(task_id)
+        return result or LocalResult(task_id, Future())
+
+
+local_backend = LocalBackend()
+
+
+def task_result(task_id: str) -> TResult:
+    """
+    :param task_id: id of a task sent via a `Proxy`
+    :return: the result of the task, from the `LocalBackend` if it is enabled
+    """
+    if local_backend.enabled:
+        return local_backend.result(task_id)
+    return AsyncResult(task_id, app=celery)
+
+
 def setup_celery(app: Flask) -> None:
     """
-    Add `Celery` cababilities to app
+    Add `Celery` cababilities to app. The tasks of the `Proxy` classes are executed in process instead if the
+    `task_backend` option of the CELERY config section is set to "local", see `LocalBackend`.
     :param app: the `Flask` app
     """
     celery.init_app(app)
+    config = get_config()
+    if config.get('CELERY', 'task_backend', fallback='celery') == 'local':
+        local_backend.init_app(app,
+                               workers=config.getint('CELERY', 'local_workers', fallback=4),
+                               latency=config.getfloat('CELERY', 'local_latency', fallback=0.0))
+        import_module('.local_tasks', __package__)  # registers the handlers
+
+
+class DispatchMetrics(object):
+    """Latency of sending tasks to the broker, per task name and process"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._stats: Dict[str, List[float]] = dict()  # task name -> [count, total seconds, max seconds]
+
+    def record(self, task_name: str, seconds: float, count: int = 1) -> None:
+        """
+        :param task_name: the dispatched task
+        :param seconds: time it took to send the tasks
+        :param count: number of tasks sent in this time
+        """
+        with self._lock:
+            stats = self._stats.setdefault(task_name, [0, 0.0, 0.0])
+            stats[0] += count
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds / count)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """:return: count, mean and max dispatch latency (seconds per task) for each task name"""
+        with self._lock:
+            return dict((task_name, dict(count=count, mean=total / count, max=max_seconds))
+                        for task_name, (count, total, max_seconds) in self._stats.items())
+
+
+dispatch_metrics = DispatchMetrics()
+
+
+class Dispatcher(object):
+    """Sends a task to `Celery` by name, created once per task of a `Proxy`"""
+
+    __slots__ = ('task_name',)
+
+    def __init__(self, task_name: str) -> None:
+        """:param task_name: full name of the task"""
+        self.task_name = task_name
+
+    def __call__(self, *args: Any, **kwargs: Any) -> TResult:
+        """
+        Send the task to be executed
+        :param args: arguments to send along
+        :param kwargs: keyword arguments to send along
+        """
+        return self.apply_async(args, kwargs)
+
+    def apply_async(self, args: Sequence[Any] = (), kwargs: Optional[Dict[str, Any]] = None,
+                    **options: Any) -> TResult:
+        """
+        Send the task with `Celery` options, e.g. task_id or link
+        :param args: arguments to send along
+        :param kwargs: keyword arguments to send along
+        :param options: options for `Celery.send_task`
+        """
+        if local_backend.enabled:
+            return local_backend.submit(self.task_name, args, kwargs, **options)
+        start = monotonic()
+        with celery.producer_or_acquire() as producer:  # pooled broker connection
+            result = celery.send_task(self.task_name, args=args, kwargs=kwargs, producer=producer, **options)
+        dispatch_metrics.record(self.task_name, monotonic() - start)
+        return result
+
+    def send_many(self, args_list: Iterable[Sequence[Any]]) -> List[TResult]:
+        """
+        Send a task for each argument tuple. The producer connection is checked out once for all of them, every task
+        is still published as a message of its own.
+        :param args_list: the arguments of each task
+        :return: the results, in order
+        """
+        if local_backend.enabled:
+            return [local_backend.submit(self.task_name, args) for args in args_list]
+        start = monotonic()
+        with celery.producer_or_acquire() as producer:
+            results = [celery.send_task(self.task_name, args=args, producer=producer) for args in args_list]
+        if results:
+            dispatch_metrics.record(self.task_name, monotonic() - start, count=len(results))
+        return results
 
 
 class Proxy(ABC):
     """
     Proxy classes allow loose coupling and not having an explicit dependency on the fanlens-brain package
-    They are light wrappers that send a task to the `Celery` queue by name
+    They are light wrappers that send a task to the `Celery` queue by name.
+    The tasks are `Dispatcher`s, resolved on first access and stored on the proxy afterwards.
     """
 
     @property
@@ -76,16 +329,12 @@ class Proxy(ABC):
         """:return: the name of the tasks module"""
         raise NotImplementedError("Must be overriden")
 
-    def __getattr__(self, fun_name: str) -> Callable[..., AsyncResult]:
-        def dispatch(*args: Any, **kwargs: Any) -> AsyncResult:
-            """
-            Wrapper that sends a task to `Celery` to be executed
-            :param args: additional arguments to send along
-            :param args: additional keyword arguments to send along
-            """
-            return celery.send_task(f"{self.tasks_module}.{fun_name}", args=args, kwargs=kwargs)
-
-        return dispatch
+    def __getattr__(self, fun_name: str) -> Dispatcher:
+        if fun_name.startswith('_'):  # e.g. protocol lookups of copy or pickle
+            raise AttributeError(fun_name)
+        dispatcher = Dispatcher(f"{self.module_name}.{fun_name}")
+        setattr(self, fun_name, dispatcher)  # __getattr__ is not consulted for it anymore
+        return dispatcher
 
 
 class Brain(Proxy):
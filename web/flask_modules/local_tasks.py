@@ -0,0 +1,40 @@
+"""
+Deterministic stand-ins for the tasks of the brain and scrape workers, executed by the `LocalBackend`.
+They answer in the same format as the workers, but neither train, predict nor scrape anything.
+"""
+from hashlib import blake2b
+from typing import Any, Iterable, List, Tuple
+from uuid import NAMESPACE_URL, uuid5
+
+from common.db.models.activities import TagTagSet
+from common.db.models.brain import Model
+from .celery import brain, local_backend, scrape
+from .database import db
+
+
+def _digest(*parts: Any) -> int:
+    return int.from_bytes(blake2b(':'.join(map(str, parts)).encode('utf-8'), digest_size=4).digest(), 'little')
+
+
+@local_backend.register(brain.train_model.task_name)
+def train_model(user_id: int, tagset_id: int, source_ids: Iterable[int], **_params: Any) -> str:
+    """:return: the id the model would get, derived from the training parameters; no model is stored"""
+    return str(uuid5(NAMESPACE_URL, 'model:%d:%d:%s' % (user_id, tagset_id, sorted(source_ids))))
+
+
+@local_backend.register(brain.predict_text.task_name)
+def predict_text(model_id: str, text: str) -> List[Tuple[int, float]]:
+    """:return: pseudo random scores, derived from model and text, for the tags of the model's tagset"""
+    tag_ids = [tag_id for tag_id, in db.session.query(TagTagSet.tag_id)
+               .join(Model, Model.tagset_id == TagTagSet.tagset_id)
+               .filter(Model.id == model_id)
+               .order_by(TagTagSet.tag_id)]
+    weights = [_digest(model_id, text, tag_id) + 1 for tag_id in tag_ids]
+    total = sum(weights)
+    return [(tag_id, weight / total) for tag_id, weight in zip(tag_ids, weights)]
+
+
+@local_backend.register(scrape.scrape_meta_for_url.task_name)
+def scrape_meta_for_url(url: str) -> Tuple[int, List[str]]:
+    """:return: an id derived from the url and no tags; no shortener entry is stored"""
+    return _digest(url), []
@@ -0,0 +1,24 @@
+"""Redis module, for direct access to redis data structures. Use the cache module for plain caching."""
+
+from flask import Flask
+from flask_redis import FlaskRedis
+
+from common.config import get_config
+
+redis_store = FlaskRedis()
+
+
+def setup_redis(app: Flask) -> None:
+    """
+    Set up redis access for the app
+    :param app: the `Flask` app
+    """
+    config = get_config()
+    app.config['REDIS_URL'] = 'redis://%(username)s:%(password)s@%(host)s:%(port)d/%(db)d' % dict(
+        username=config.get('REDIS', 'username'),
+        password=config.get('REDIS', 'password'),
+        host=config.get('REDIS', 'host'),
+        port=config.getint('REDIS', 'port'),
+        db=0
+    )
+    redis_store.init_app(app)